@@ -0,0 +1,487 @@
+"""
+CyberBot benchmarks.
+
+  python bench.py format   [--blocks 4 16 64] [--repeat 20]
+  python bench.py semantic [--sizes 10000 100000] [--dim 768] [--queries 200]
+  python bench.py gen      [--backend fake|real] [--requests 20] [--concurrency 1]
+                           [--rate 60] [--ttft 0.25] [--streams rec.json]
+                           [--save-baseline b.json | --baseline b.json]
+  python bench.py record   --out rec.json        (token streams from the real MODEL)
+  python bench.py fake     [--port 11435] [--rate 60] [--ttft 0.25] [--streams rec.json]
+  python bench.py payload                        (theme bytes sent per rerun)
+  python bench.py pool     [--backends 3] [--requests 60] [--concurrency 6]
+                           (least-outstanding routing and failover over fakes)
+  python bench.py retrieval [--root DIR | --lines 150000] [--workers N] [--queries 300]
+                           (project indexing: cold / no-op / 1% changed, BM25 query latency)
+"""
+
+import argparse, json, os, re, sys, time, random, shutil, statistics, tempfile, threading
+from concurrent.futures import ThreadPoolExecutor
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+import cyberbot as cb
+import project_index as pi
+
+# ═══════════════════════════════════════════════════════════════════════
+#  LEGACY FORMATTER  (regex cascade replaced by cb.render_ai, kept as the
+#  reference implementation for the format benchmark)
+# ═══════════════════════════════════════════════════════════════════════
+L_CODE_RE   = re.compile(r'```(\w*)\n?(.*?)```', re.DOTALL)
+L_INLINE_RE = re.compile(r'`([^`\n]+)`')
+L_BOLD_RE   = re.compile(r'\*\*(.+?)\*\*')
+L_ITALIC_RE = re.compile(r'(?<!\*)\*(?!\*)(.+?)(?<!\*)\*(?!\*)')
+
+def legacy_format_ai_text(text: str) -> str:
+    text = L_CODE_RE.sub(lambda m: cb.code_window_html(m.group(1), cb._esc(m.group(2).rstrip())), text)
+    text = L_BOLD_RE.sub(r'<strong>\1</strong>', text)
+    text = L_ITALIC_RE.sub(r'<em>\1</em>', text)
+    text = L_INLINE_RE.sub(lambda m: f'<span class="icod">{cb._esc(m.group(1))}</span>', text)
+    out = []
+    for line in text.split('\n'):
+        s = line.strip()
+        if any(s.startswith(ic) for ic in cb.SECTION_ICONS):
+            out.append(f'<span class="shdr">{s}</span>')
+        elif re.match(r'^[•\-\*]\s', s) and not s.startswith('**'):
+            out.append(f'<div class="blt">▸ {s[2:]}</div>')
+        elif re.match(r'^\d+\.\s', s):
+            out.append(f'<div class="blt">{s}</div>')
+        else:
+            out.append(line)
+    return '<br>'.join(out)
+
+def legacy_split_thoughts(text: str):
+    thought, main, in_t = [], [], False
+    for line in text.split('\n'):
+        if any(line.strip().startswith(m) for m in cb.THOUGHT_MARKERS):
+            in_t = True
+        (thought if in_t else main).append(line)
+        if in_t and line.strip() == '' and len(thought) > 1:
+            in_t = False
+    if not thought:
+        return text, None
+    return '\n'.join(main).strip(), cb.THOUGHT_HDR + '\n'.join(thought).replace('\n', '<br>') + '</div>'
+
+def legacy_render(text: str):
+    main, thought = legacy_split_thoughts(text)
+    return legacy_format_ai_text(main), thought
+
+# ═══════════════════════════════════════════════════════════════════════
+#  SYNTHETIC RESPONSES
+# ═══════════════════════════════════════════════════════════════════════
+CODE_SNIPPET = '''def merge_sort(items: list[int]) -> list[int]:
+    """Sort *items* with a stable top-down merge sort."""
+    if len(items) <= 1:
+        return items
+    mid = len(items) // 2
+    left, right = merge_sort(items[:mid]), merge_sort(items[mid:])
+    out, i, j = [], 0, 0
+    while i < len(left) and j < len(right):
+        # take from the left run on ties to keep the sort stable
+        if left[i] <= right[j]:
+            out.append(left[i]); i += 1
+        else:
+            out.append(right[j]); j += 1
+    return out + left[i:] + right[j:]
+'''
+
+def make_response(blocks: int) -> str:
+    parts = ["Use a **stable** merge sort; it runs in `O(n log n)` for *every* input.\n"]
+    for b in range(blocks):
+        parts.append(
+            f"🔍 Problem Breakdown {b}: split the list, sort halves, **merge** them.\n"
+            f"- keeps equal keys in order\n- needs `O(n)` extra space\n1. split\n2. merge\n\n"
+            f"```python\n{CODE_SNIPPET}```\n\n"
+            f"**How it works:** the `while` loop walks both runs once; see *merge step*.\n\n"
+        )
+    parts.append("✅ Test Cases: `merge_sort([3, 1, 2])` returns `[1, 2, 3]`.\n")
+    return ''.join(parts)
+
+BENCH_PROMPTS = {
+    "Normal":       "What is the difference between a process and a thread?",
+    "Deep Thought": "Design a rate limiter for a public REST API.",
+    "Code Master":  "Implement an LRU cache in Python with O(1) get and put.",
+    "Debug":        "def avg(xs): return sum(xs) / len(xs)\n\nZeroDivisionError on an empty list.",
+}
+
+def synthetic_stream(chars_per_token: int = 4) -> list:
+    text = make_response(4)
+    return [text[i:i + chars_per_token] for i in range(0, len(text), chars_per_token)]
+
+def _time(fn, arg, repeat: int) -> float:
+    runs = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn(arg)
+        runs.append(time.perf_counter() - t0)
+    return statistics.median(runs)
+
+# ═══════════════════════════════════════════════════════════════════════
+#  FAKE OLLAMA  (replays token streams at a fixed rate; no model needed)
+# ═══════════════════════════════════════════════════════════════════════
+class FakeOllama(ThreadingHTTPServer):
+    # Speaks the parts of the Ollama HTTP API CyberBot uses. Chat requests are
+    # answered with the recorded stream for the request's mode (matched on the
+    # system prompt), after `ttft` seconds, at `rate` tokens/s (0 = unthrottled).
+    daemon_threads = True
+
+    def __init__(self, port: int, rate: float, ttft: float, streams: dict = None):
+        super().__init__(("127.0.0.1", port), _FakeHandler)
+        self.rate, self.ttft = rate, ttft
+        self.streams = streams or {}
+        self.default = synthetic_stream()
+        self.by_system = {cb.MODE_PROMPTS[m]: m for m in cb.MODE_PROMPTS}
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    def start(self) -> "FakeOllama":
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+class _FakeHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def _json(self, obj: dict):
+        body = json.dumps(obj).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path in ("/api/tags", "/api/ps"):
+            return self._json({"models": [{"model": cb.MODEL, "name": cb.MODEL}]})
+        self._json({})
+
+    def do_POST(self):
+        req = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        if self.path == "/api/embed":
+            inp = req.get("input")
+            inp = [inp] if isinstance(inp, str) else inp
+            return self._json({"model": req.get("model"), "embeddings": [[float(len(t) % 7), 1.0, 0.5] for t in inp]})
+        if self.path != "/api/chat" or not req.get("stream", True):
+            return self._json({"model": req.get("model"), "response": "", "done": True, "done_reason": "load"})
+        msgs = req.get("messages") or [{}]
+        mode = self.server.by_system.get(msgs[0].get("content"), "Normal")
+        toks = self.server.streams.get(mode) or self.server.default
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+        def chunk(obj: dict):
+            line = (json.dumps(obj) + "\n").encode()
+            self.wfile.write(b"%x\r\n%s\r\n" % (len(line), line))
+            self.wfile.flush()
+
+        t0 = time.perf_counter()
+        time.sleep(self.server.ttft)
+        t1 = time.perf_counter()
+        for i, tok in enumerate(toks):
+            if self.server.rate:
+                time.sleep(max(0.0, t1 + i / self.server.rate - time.perf_counter()))
+            chunk({"model": cb.MODEL, "message": {"role": "assistant", "content": tok}, "done": False})
+        t2 = time.perf_counter()
+        chunk({"model": cb.MODEL, "message": {"role": "assistant", "content": ""}, "done": True,
+               "done_reason": "stop", "load_duration": 0, "total_duration": int((t2 - t0) * 1e9),
+               "prompt_eval_count": cb.msgs_tokens(msgs), "prompt_eval_duration": int((t1 - t0) * 1e9),
+               "eval_count": len(toks), "eval_duration": int((t2 - t1) * 1e9)})
+        self.wfile.write(b"0\r\n\r\n")
+
+def load_json(path: str) -> dict:
+    if not path:
+        return {}
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+# ═══════════════════════════════════════════════════════════════════════
+#  BENCHMARKS
+# ═══════════════════════════════════════════════════════════════════════
+def bench_format(args):
+    print(f"{'blocks':>7} {'KiB':>8} {'legacy MB/s':>12} {'single-pass MB/s':>17} {'speedup':>8}")
+    for n in args.blocks:
+        text = make_response(n)
+        mb   = len(text.encode()) / 1e6
+        old  = _time(legacy_render, text, args.repeat)
+        new  = _time(cb.render_ai, text, args.repeat)
+        print(f"{n:>7} {len(text.encode()) / 1024:>8.1f} {mb / old:>12.1f} {mb / new:>17.1f} {old / new:>7.2f}x")
+
+def _pct(values: list, p: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+def bench_semantic(args):
+    import numpy as np
+    rng    = np.random.default_rng(0)
+    scopes = [f"mode{i}" for i in range(4)]
+    print(f"{'entries':>8} {'insert µs/row':>14} {'lookup p50 µs':>14} {'p99 µs':>9} {'matrix MB':>10}")
+    for n in args.sizes:
+        vecs  = rng.standard_normal((n, args.dim)).astype(np.float32)
+        vecs /= np.linalg.norm(vecs, axis=1, keepdims=True)
+        ix    = cb.SemanticIndex(":memory:", n + 1)
+        t0    = time.perf_counter()
+        for i, v in enumerate(vecs):
+            ix.add(v, scopes[i % 4], "cached answer")
+        ins   = (time.perf_counter() - t0) / n * 1e6
+        runs  = []
+        for q in range(args.queries):
+            # a perturbed stored vector, so roughly half the lookups are hits
+            v  = vecs[rng.integers(n)] + rng.standard_normal(args.dim).astype(np.float32) * (0.01 if q % 2 else 0.2)
+            v /= np.linalg.norm(v)
+            t0 = time.perf_counter()
+            ix.search(v, scopes[q % 4], cb.SEMANTIC_THRESHOLD)
+            runs.append((time.perf_counter() - t0) * 1e6)
+        print(f"{n:>8} {ins:>14.1f} {_pct(runs, 50):>14.0f} {_pct(runs, 99):>9.0f} {sum(b.vecs.nbytes for b in ix._blocks.values()) / 1e6:>10.1f}")
+
+def consume(msgs: list, options: dict = None) -> dict:
+    # One request through stream_response and the same per-token work
+    # handle_send does (StreamRenderer feed, throttled frames, final render).
+    live, stats, acc, render = cb.StreamRenderer(), {}, 0, 0.0
+    t0 = time.perf_counter()
+    first = None
+    for tok in cb.stream_response(msgs, stats, "bench", options=options):
+        if first is None:
+            first = time.perf_counter()
+        r0 = time.perf_counter()
+        live.feed(tok)
+        acc += len(tok)
+        if acc % 60 < len(tok) or acc < 80:
+            live.html()
+        render += time.perf_counter() - r0
+    end = time.perf_counter()
+    r0 = time.perf_counter()
+    cb.render_ai(live.text)
+    render += time.perf_counter() - r0
+    first = first or end
+    toks  = stats.get("eval_count") or 0
+    return {"ttft_ms": (first - t0) * 1e3, "e2e_ms": (end - t0) * 1e3,
+            "tok_s": toks / (end - first) if end > first else 0.0, "render_ms": render * 1e3}
+
+METRICS = ("ttft_ms", "tok_s", "e2e_ms", "render_ms")
+
+def bench_gen(args):
+    if args.backend == "fake":
+        fake = FakeOllama(0, args.rate, args.ttft, load_json(args.streams)).start()
+        os.environ["OLLAMA_HOST"] = fake.url
+    cb.scheduler().limit = args.concurrency
+    modes  = args.modes or list(cb.MODE_PROMPTS)
+    result = {}
+    print(f"{args.backend} backend · {args.requests} requests/mode · concurrency {args.concurrency}")
+    print(f"{'mode':<13}" + ''.join(f"{m + ' p50/p95/p99':>28}" for m in METRICS))
+    for mode in modes:
+        opts = cb.gen_options(mode, {"adaptive": False})   # fixed limits keep runs comparable
+        msgs = cb.build_msgs([], BENCH_PROMPTS[mode], mode, cb.prompt_budget(opts["num_predict"]))
+        consume(msgs, opts)                         # warm-up: connection, model load
+        with ThreadPoolExecutor(args.concurrency) as pool:
+            runs = list(pool.map(lambda _: consume(msgs, opts), range(args.requests)))
+        result[mode] = {m: {f"p{p}": round(_pct([r[m] for r in runs], p), 3) for p in (50, 95, 99)} for m in METRICS}
+        print(f"{mode:<13}" + ''.join(f"{'{p50:.1f} / {p95:.1f} / {p99:.1f}'.format(**result[mode][m]):>28}" for m in METRICS))
+    if args.save_baseline:
+        with open(args.save_baseline, "w", encoding="utf-8") as f:
+            json.dump({"backend": args.backend, "rate": args.rate, "ttft": args.ttft, "modes": result}, f, indent=1)
+        print(f"baseline written to {args.save_baseline}")
+    if args.baseline:
+        sys.exit(compare(load_json(args.baseline)["modes"], result, args.tolerance))
+
+def compare(base: dict, cur: dict, tolerance: float) -> int:
+    # p50/p95 deltas vs a stored run; higher is worse except for tok/s.
+    bad = 0
+    print(f"\nvs baseline (tolerance {tolerance:.0%})")
+    for mode in cur:
+        for m in METRICS:
+            for p in ("p50", "p95"):
+                old, new = base.get(mode, {}).get(m, {}).get(p), cur[mode][m][p]
+                if not old:
+                    continue
+                delta = (new - old) / old * (-1 if m == "tok_s" else 1)
+                flag  = "REGRESSION" if delta > tolerance else ""
+                bad  += bool(flag)
+                print(f"  {mode:<13} {m:<10} {p}  {old:>9.1f} → {new:>9.1f}  {delta:+7.1%}  {flag}")
+    return 1 if bad else 0
+
+def bench_record(args):
+    # Capture real token streams per mode so the fake backend replays realistic
+    # token sizes and lengths.
+    out = {}
+    for mode in args.modes or list(cb.MODE_PROMPTS):
+        opts      = cb.gen_options(mode, {"adaptive": False})
+        out[mode] = list(cb.stream_response(cb.build_msgs([], BENCH_PROMPTS[mode], mode), {}, "bench", options=opts))
+        print(f"{mode:<13} {len(out[mode])} tokens")
+    with open(args.out, "w", encoding="utf-8") as f:
+        json.dump(out, f, ensure_ascii=False)
+
+def bench_fake(args):
+    fake = FakeOllama(args.port, args.rate, args.ttft, load_json(args.streams))
+    print(f"fake Ollama on {fake.url}  ·  ttft {args.ttft}s  ·  {args.rate or 'unthrottled'} tok/s   (OLLAMA_HOST={fake.url})")
+    fake.serve_forever()
+
+def bench_pool(args):
+    # Several fakes, each slower to first token than the last, plus one host
+    # nothing listens on, behind one BackendPool: shows how requests spread,
+    # that the dead host only costs a failover, and the per-backend TTFT.
+    fakes = [FakeOllama(0, args.rate, args.ttft * (1 + i), load_json(args.streams)).start()
+             for i in range(args.backends)]
+    hosts = ["127.0.0.1:9"] + [f.url for f in fakes]
+    sch   = cb.scheduler()
+    sch.pool, sch.limit = cb.BackendPool(hosts), args.concurrency
+    msgs  = cb.build_msgs([], BENCH_PROMPTS["Normal"], "Normal")
+    t0    = time.perf_counter()
+    with ThreadPoolExecutor(args.concurrency) as pool:
+        runs = list(pool.map(lambda _: consume(msgs), range(args.requests)))
+    wall  = time.perf_counter() - t0
+    print(f"{args.requests} requests · concurrency {args.concurrency} · {wall:.1f}s · "
+          f"e2e p50 {_pct([r['e2e_ms'] for r in runs], 50):.0f} ms")
+    print(f"{'backend':<26} {'served':>7} {'failed':>7} {'share':>7} {'ttft p50 ms':>12}")
+    for b in sch.pool.backends:
+        print(f"{b.host:<26} {b.served:>7} {b.failed:>7} {b.served / args.requests:>7.0%} {b.p50() * 1e3:>12.0f}")
+
+def synthetic_repo(root: str, lines: int, seed: int = 0) -> int:
+    # A Python package of ~300-line modules: functions and classes named from
+    # a fixed vocabulary, so identifier statistics look like a real codebase.
+    rng   = random.Random(seed)
+    words = sorted({''.join(rng.choice("abcdefghijklmnopqrstuvwxyz") for _ in range(rng.randint(3, 9)))
+                    for _ in range(4000)})
+    made, n = 0, 0
+    while made < lines:
+        pkg = os.path.join(root, f"pkg{n // 50}")
+        os.makedirs(pkg, exist_ok=True)
+        out = [f'"""Module {n}."""', "import os, sys", ""]
+        while len(out) < 300:
+            a, b, c = rng.sample(words, 3)
+            if rng.random() < 0.2:
+                out += [f"class {a.title()}{b.title()}:", f"    def __init__(self, {c}):", f"        self.{c} = {c}", ""]
+                for _ in range(rng.randint(2, 5)):
+                    m, v = rng.sample(words, 2)
+                    out += [f"    def {m}_{v}(self, {v}=None):",
+                            f"        # {' '.join(rng.sample(words, 6))}",
+                            f"        return {v} or self.{c}", ""]
+            else:
+                body = [f"    {rng.choice(words)} = {rng.choice(words)}_{rng.choice(words)}({c})"
+                        for _ in range(rng.randint(3, 12))]
+                out += [f"def {a}_{b}({c}):", f'    """{" ".join(rng.sample(words, 8))}"""', *body,
+                        f"    return {c}", ""]
+        with open(os.path.join(pkg, f"mod{n}.py"), "w", encoding="utf-8") as f:
+            f.write("\n".join(out))
+        made += len(out)
+        n    += 1
+    return made
+
+def bench_retrieval(args):
+    tmp  = root = tempfile.mkdtemp(prefix="cyberbot-repo-")
+    if args.root:
+        # The 1%-changed pass appends to files, so it runs on a copy of the repo.
+        root = os.path.join(tmp, "repo")
+        shutil.copytree(args.root, root, symlinks=True,
+                        ignore=lambda d, names: [n for n in names if n in pi.SKIP_DIRS or n.startswith(".")])
+        print(f"copied {args.root} to {root}")
+    else:
+        print(f"synthetic repo: {synthetic_repo(root, args.lines):,} lines in {root}")
+    db = os.path.join(tempfile.mkdtemp(prefix="cyberbot-ix-"), "index.db")
+    try:
+        ix = pi.ProjectIndex(root, db)
+        print(f"{'pass':<22} {'seconds':>8} {'files':>7} {'changed':>8} {'chunks':>8}")
+        for label in ("cold", "no changes"):
+            r = ix.update(args.workers)
+            print(f"{label:<22} {r['seconds']:>8.2f} {r['scanned']:>7,} {r['changed']:>8,} {r['chunks']:>8,}")
+        files = [p for p, _, _ in pi.walk(root)]
+        for p in random.Random(1).sample(files, max(1, len(files) // 100)):
+            with open(p, "a", encoding="utf-8") as f:
+                f.write("\n# touched\n")
+        r = ix.update(args.workers)
+        print(f"{'1% of files changed':<22} {r['seconds']:>8.2f} {r['scanned']:>7,} {r['changed']:>8,} {r['chunks']:>8,}")
+        # Queries: a few identifiers from a random chunk, like a pasted snippet or error.
+        rng  = random.Random(2)
+        ids  = [row[0] for row in ix._db.execute("SELECT text FROM chunks ORDER BY RANDOM() LIMIT ?", (args.queries,))]
+        runs = []
+        for text in ids:
+            q  = " ".join(rng.sample(pi.WORD_RE.findall(text), min(8, len(pi.WORD_RE.findall(text)))))
+            t0 = time.perf_counter()
+            ix.search(q, cb.INDEX_TOP_K)
+            runs.append((time.perf_counter() - t0) * 1e3)
+        print(f"\nquery top-{cb.INDEX_TOP_K} over {ix.n:,} chunks / {ix.lines:,} lines: "
+              f"p50 {_pct(runs, 50):.1f} ms · p95 {_pct(runs, 95):.1f} ms · p99 {_pct(runs, 99):.1f} ms")
+    finally:
+        shutil.rmtree(os.path.dirname(db), ignore_errors=True)
+        shutil.rmtree(tmp, ignore_errors=True)
+
+def _rerun_bytes(static: bool) -> int:
+    # Markdown/HTML bytes one empty-chat rerun of the app emits.
+    import streamlit as st
+    from streamlit import config
+    from streamlit.testing.v1 import AppTest
+    config.set_option("server.enableStaticServing", static)
+    st.cache_resource.clear()
+    at = AppTest.from_file(cb.__file__, default_timeout=60).run()
+    return sum(len(m.value.encode()) for m in at.markdown)
+
+def bench_payload(args):
+    legacy = len((cb.CSS + '<div class="sky">' + cb.SKYLINE + '</div>').encode())
+    print(f"{'theme delivery':<24} {'theme bytes':>12} {'rerun bytes':>12}")
+    rows   = []
+    for label, static in (("inline, minified", False), ("static files", True)):
+        head, sky = cb.build_theme(static)
+        rows.append((label, len((head + sky).encode()), _rerun_bytes(static)))
+    # the old page differs from the inline one only in the theme markup
+    rows.insert(0, ("inline, unminified", legacy, rows[0][2] - rows[0][1] + legacy))
+    for label, theme, rerun in rows:
+        print(f"{label:<24} {theme:>12,} {rerun:>12,}")
+
+def _fake_args(p, port: int = None):
+    if port is not None:
+        p.add_argument("--port", type=int, default=port)
+    p.add_argument("--rate", type=float, default=60.0, help="tokens/s, 0 = as fast as possible")
+    p.add_argument("--ttft", type=float, default=0.25, help="seconds before the first token")
+    p.add_argument("--streams", help="JSON of recorded token streams per mode (bench.py record)")
+
+def main():
+    ap  = argparse.ArgumentParser(description="CyberBot benchmarks")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    p   = sub.add_parser("format", help="render_ai vs the legacy regex cascade")
+    p.add_argument("--blocks", type=int, nargs="+", default=[4, 16, 64, 256])
+    p.add_argument("--repeat", type=int, default=20)
+    p.set_defaults(fn=bench_format)
+    p   = sub.add_parser("semantic", help="SemanticIndex insert/lookup latency")
+    p.add_argument("--sizes", type=int, nargs="+", default=[10000, 50000, 100000])
+    p.add_argument("--dim", type=int, default=768)
+    p.add_argument("--queries", type=int, default=200)
+    p.set_defaults(fn=bench_semantic)
+    p   = sub.add_parser("gen", help="TTFT, tok/s, end-to-end and render time per mode")
+    p.add_argument("--backend", choices=["fake", "real"], default="fake")
+    p.add_argument("--modes", nargs="+", choices=list(cb.MODE_PROMPTS))
+    p.add_argument("--requests", type=int, default=20)
+    p.add_argument("--concurrency", type=int, default=1)
+    p.add_argument("--save-baseline", metavar="FILE")
+    p.add_argument("--baseline", metavar="FILE", help="compare and exit 1 on regressions")
+    p.add_argument("--tolerance", type=float, default=0.10)
+    _fake_args(p)
+    p.set_defaults(fn=bench_gen)
+    p   = sub.add_parser("record", help="save real token streams for the fake backend")
+    p.add_argument("--out", required=True)
+    p.add_argument("--modes", nargs="+", choices=list(cb.MODE_PROMPTS))
+    p.set_defaults(fn=bench_record)
+    p   = sub.add_parser("fake", help="run the fake Ollama server standalone")
+    _fake_args(p, 11435)
+    p.set_defaults(fn=bench_fake)
+    p   = sub.add_parser("payload", help="theme bytes per rerun, inline vs static")
+    p.set_defaults(fn=bench_payload)
+    p   = sub.add_parser("pool", help="request spread and failover over several fake backends")
+    p.add_argument("--backends", type=int, default=3)
+    p.add_argument("--requests", type=int, default=60)
+    p.add_argument("--concurrency", type=int, default=6)
+    _fake_args(p)
+    p.set_defaults(fn=bench_pool)
+    p   = sub.add_parser("retrieval", help="project index build / rescan time and BM25 query latency")
+    p.add_argument("--root", help="index this directory instead of a synthetic repo")
+    p.add_argument("--lines", type=int, default=150000, help="size of the synthetic repo")
+    p.add_argument("--workers", type=int, help="indexing processes (default: all cores)")
+    p.add_argument("--queries", type=int, default=300)
+    p.set_defaults(fn=bench_retrieval)
+    args = ap.parse_args()
+    args.fn(args)
+
+if __name__ == "__main__":
+    main()
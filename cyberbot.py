@@ -7,15 +7,26 @@
 ╚══════════════════════════════════════════════════════════════════════╝
 """
 
-import re, time, datetime, hashlib
+import re, os, io, time, datetime, hashlib, hmac, secrets, json, threading, sqlite3, asyncio, queue, shutil, tarfile, zipfile
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
 import streamlit as st
+from project_index import ProjectIndex
 
 try:
     import ollama as _ollama
+    import httpx
     OLLAMA_PKG = True
 except ImportError:
     OLLAMA_PKG = False
 
+try:
+    import numpy as np
+    NUMPY_PKG = True
+except ImportError:
+    NUMPY_PKG = False
+
 try:
     import speech_recognition as _sr
     AUDIO_PKG = True
@@ -28,7 +39,54 @@ except ImportError:
 APP_NAME    = "CyberBot"
 APP_VER     = "v4.0"
 MODEL       = "hf.co/MaziyarPanahi/codegemma-2b-GGUF:Q4_k_M"
-MAX_HISTORY = 30
+FAST_MODEL   = os.environ.get("CYBERBOT_FAST_MODEL", MODEL)     # quick lookups and short questions
+STRONG_MODEL = os.environ.get("CYBERBOT_STRONG_MODEL", MODEL)   # heavy Code Master / Debug work
+ROUTE_SCORE  = 3              # complexity score at which a request goes to STRONG_MODEL
+MAX_HISTORY = 30              # exchanges (user + assistant pairs)
+RENDER_RECENT = 4             # exchanges rendered in full; older ones collapse to one summary line
+OLDER_PAGE  = 20              # messages fetched from the store per "load older" click
+NUM_CTX     = 8192            # model context window, tokens
+NUM_PREDICT = 4096            # reply budget; the prompt gets NUM_CTX - NUM_PREDICT
+CHARS_PER_TOKEN = 3.2         # token estimate for code-heavy chat text
+CTX_REFILL  = 0.5             # share of the prompt budget kept when the window has to move
+RENDER_CACHE_MB = 64          # shared rendered-HTML cache, all sessions
+HEALTH_TTL      = 5.0         # seconds between background Ollama probes
+PROBE_TIMEOUT   = 2.0         # per-probe HTTP timeout
+KEEP_ALIVE      = 600         # seconds Ollama keeps the routed models resident after a request
+SESSION_IDLE    = 900         # stop refreshing keep-alive after this long without a rerun
+DATA_DIR        = os.environ.get("CYBERBOT_HOME", os.path.join(os.path.expanduser("~"), ".cyberbot"))
+RESPONSE_CACHE_MB  = 256      # on-disk answer cache, LRU beyond this
+RESPONSE_CACHE_TTL = 7 * 86400
+EMBED_MODEL        = "nomic-embed-text"   # local Ollama embedding model for the semantic cache
+EMBED_TIMEOUT      = 5.0      # seconds one embedding call may take before the next host is tried
+SEMANTIC_THRESHOLD = 0.92     # cosine similarity needed to reuse an answer
+SEMANTIC_MAX       = 20000    # cached first-turn answers kept in the vector index
+CONVERSATION_TTL   = 30 * 86400   # stored conversations untouched this long are deleted
+COMPACT_AFTER   = 8           # exchanges sent verbatim after the rolling summary before it is extended
+COMPACT_KEEP    = 3           # newest exchanges never folded into the summary
+SUMMARY_TOKENS  = 400         # reply budget of one summary update
+PROJECT_MODES   = ("Debug", "Code Master")   # modes that get retrieved project code
+INDEX_TOP_K     = 6           # project chunks retrieved per question
+INDEX_SHARE     = 0.35        # most of the prompt budget retrieved chunks may take
+INDEX_RESCAN    = 30.0        # seconds between incremental rescans of the active project
+UPLOAD_MAX_MB   = 500         # uncompressed size an uploaded project archive may expand to
+UPLOAD_MAX_FILES = 50000      # members an uploaded project archive may have
+PROJECT_ROOT    = os.environ.get("CYBERBOT_PROJECT_ROOT", "")   # folders under it may be indexed by path; "" = uploads only
+MAP_TRIGGER     = 3000        # Debug inputs over this many tokens are analysed in parts (map-reduce)
+MAP_CHUNK       = 1500        # tokens per part
+MAP_OVERLAP     = 20          # lines shared by neighbouring parts
+MAP_PARALLEL    = int(os.environ.get("CYBERBOT_MAP_PARALLEL", 2))      # parts of one question analysed at once
+MAP_NOTES       = 300         # reply budget per part
+MAP_REDUCE_SHARE = 0.6        # share of the prompt budget for the merged findings
+METRICS_PORT    = int(os.environ.get("CYBERBOT_METRICS_PORT", 0))     # Prometheus /metrics beside the UI, 0 = off
+METRICS_HOST    = os.environ.get("CYBERBOT_METRICS_HOST", "127.0.0.1") # interface it binds; 0.0.0.0 for a remote scraper
+MAX_CONCURRENT  = int(os.environ.get("CYBERBOT_MAX_CONCURRENT", 2))   # Ollama streams in flight, all sessions
+CLIENT_TIMEOUT  = 30.0        # cancel a request once its session stops reading for this long
+GEN_TIMEOUT     = 300.0       # hard wall-clock limit per generation once it holds a slot
+BACKEND_COOLDOWN = 30.0       # seconds a failed Ollama host is tried last
+ADAPT_MIN       = 20          # answers seen in a mode before its num_predict adapts
+ADAPT_HEADROOM  = 1.5         # learned num_predict = p95 completion length × this
+ADAPT_FLOOR     = 256         # learned num_predict never goes below this
 
 # ═══════════════════════════════════════════════════════════════════════
 #  SYSTEM PROMPTS
@@ -88,6 +146,19 @@ MODE_PROMPTS = {
     "Debug":        DEBUG_SYSTEM,
 }
 
+SUMMARY_SYSTEM = """You keep a running summary of a conversation between a user and CyberBot, a coding assistant.
+Merge the previous summary and the new turns into one updated summary of at most 250 words.
+Keep the user's goals, facts and constraints they gave, decisions made, names of files,
+functions and variables, errors and how they were fixed, and open questions. Reduce code
+to signatures and one-line descriptions. Drop greetings and repetition.
+Answer with the bullet points only."""
+SUMMARY_HEAD = "\n\nSUMMARY OF THE EARLIER CONVERSATION (older turns are not repeated below):\n"
+
+MAP_SYSTEM = """You are one of several reviewers, each reading one part of a long input a user pasted for debugging.
+Report only what helps find the bug: errors, exceptions, stack frames, suspicious code or values,
+each with its line number. Quote at most one short line per finding.
+Answer with up to 8 bullet points, or exactly "nothing relevant"."""
+
 # ═══════════════════════════════════════════════════════════════════════
 #  CSS  — Full Neo-Noir Cyberpunk City Rebuild
 #  Colour palette extracted from kvacm cyberpunk city artwork:
@@ -97,8 +168,6 @@ MODE_PROMPTS = {
 # ═══════════════════════════════════════════════════════════════════════
 CSS = """
 <style>
-@import url('https://fonts.googleapis.com/css2?family=Orbitron:wght@400;600;700;900&family=Share+Tech+Mono&family=Rajdhani:wght@300;400;500;600;700&display=swap');
-
 :root {
   --bg:     #050912;
   --navy:   #0A1628;
@@ -344,6 +413,14 @@ html, body {
 
 .mts { font-family:'Share Tech Mono',monospace; font-size:0.50rem; color:rgba(232,246,255,0.18); text-align:right; margin-top:6px; }
 
+.msum {
+  display:flex; gap:12px; align-items:baseline; padding:6px 12px; margin:2px 0 4px;
+  border:1px solid rgba(0,232,255,0.10); border-left:2px solid rgba(255,0,128,0.45); border-radius:3px;
+  background:rgba(0,232,255,0.025); font-family:'Share Tech Mono',monospace; font-size:0.66rem;
+}
+.msum .msq { flex:1; color:rgba(232,246,255,0.55); white-space:nowrap; overflow:hidden; text-overflow:ellipsis; }
+.msum .msm { color:rgba(0,232,255,0.40); font-size:0.54rem; white-space:nowrap; }
+
 .dinfo {
   background:rgba(255,215,0,0.04); border:1px dashed rgba(255,215,0,0.22); border-radius:4px;
   margin-top:7px; padding:7px 11px;
@@ -399,7 +476,7 @@ html, body {
 
 /* ── SKYLINE STRIP ───────────────────────────────────────────────── */
 .sky { width:100%; height:72px; position:relative; overflow:hidden; margin-top:8px; }
-.sky svg { width:100%; height:100%; }
+.sky svg, .sky img { width:100%; height:100%; display:block; }
 
 /* ── DIVIDER ─────────────────────────────────────────────────────── */
 .ndiv { height:1px; margin:11px 0; border:none; background:linear-gradient(90deg,transparent 0%,rgba(0,232,255,0.22) 30%,rgba(255,0,128,0.22) 70%,transparent 100%); }
@@ -430,19 +507,27 @@ LANG_MAP = {
     "md":"MARKDOWN","text":"TEXT","txt":"TEXT","":"CODE",
 }
 
-CODE_RE   = re.compile(r'```(\w*)\n?(.*?)```', re.DOTALL)
-INLINE_RE = re.compile(r'`([^`\n]+)`')
-BOLD_RE   = re.compile(r'\*\*(.+?)\*\*')
-ITALIC_RE = re.compile(r'(?<!\*)\*(?!\*)(.+?)(?<!\*)\*(?!\*)')
+FENCE     = '```'
+FENCE_RE  = re.compile(r'\w*')
+INLINE_RE = re.compile(r'`([^`\n]+)`|\*\*(.+?)\*\*|(?<!\*)\*(?!\*)(.+?)(?<!\*)\*(?!\*)')
 
-SECTION_ICONS = ['🔍','💡','⚙️','✅','🚀','📌','⚠️','🔧','📊','🐛','🔬','🧪']
+SECTION_ICONS   = ('🔍','💡','⚙️','✅','🚀','📌','⚠️','🔧','📊','🐛','🔬','🧪')
+THOUGHT_MARKERS = (
+    '🔍 Problem Breakdown','🔍 ANALYSIS','💡 Approach','💡 APPROACH',
+    '⚙️ Implementation','⚙️ SOLUTION','✅ Test Cases','✅ VERIFICATION',
+    '🚀 Optimisations','🚀 OPTIMISATION','🐛 Root Cause','🔬 Analysis',
+    '🔧 Fix','🔧 Fixed Code','🧪 Prevention','[ANALYSIS]','[APPROACH]',
+)
+THOUGHT_HDR = '<div class="thgt"><span class="thgt-h">◈ NEURAL THOUGHT PROCESS</span>'
 
 def _esc(t: str) -> str:
     return t.replace("&","&amp;").replace("<","&lt;").replace(">","&gt;")
 
 def code_block_html(lang_raw: str, code: str) -> str:
+    return code_window_html(lang_raw, _esc(code.rstrip()).replace('\n', '<br>'))
+
+def code_window_html(lang_raw: str, body: str) -> str:
     lbl  = LANG_MAP.get(lang_raw.lower().strip(), lang_raw.upper() or "CODE")
-    body = _esc(code.rstrip())
     return (
         f'<div class="cwin">'
         f'<div class="cbar">'
@@ -454,79 +539,1536 @@ def code_block_html(lang_raw: str, code: str) -> str:
         f'</div>'
     )
 
-def format_ai_text(text: str) -> str:
-    # 1. Fenced code blocks
-    text = CODE_RE.sub(lambda m: code_block_html(m.group(1), m.group(2)), text)
-    # 2. Bold / italic
-    text = BOLD_RE.sub(r'<strong>\1</strong>', text)
-    text = ITALIC_RE.sub(r'<em>\1</em>', text)
-    # 3. Inline code
-    text = INLINE_RE.sub(lambda m: f'<span class="icod">{_esc(m.group(1))}</span>', text)
-    # 4. Line processing
-    out = []
+def _inline_sub(m) -> str:
+    if m.group(1) is not None:
+        return f'<span class="icod">{_esc(m.group(1))}</span>'
+    if m.group(2) is not None:
+        return f'<strong>{_inline(m.group(2))}</strong>'
+    return f'<em>{_inline(m.group(3))}</em>'
+
+def _inline(s: str) -> str:
+    # Inline code, bold and italic in one leftmost-first scan; code spans win,
+    # so nothing inside them is ever re-formatted.
+    return INLINE_RE.sub(_inline_sub, s) if ('`' in s or '*' in s) else s
+
+def _line_html(line: str) -> str:
+    s = line.strip()
+    if s.startswith(SECTION_ICONS):
+        return f'<span class="shdr">{_inline(s)}</span>'
+    if len(s) > 1 and s[0] in '•-*' and s[1].isspace():
+        return f'<div class="blt">▸ {_inline(s[2:])}</div>'
+    d = len(s) - len(s.lstrip('0123456789'))
+    if d and s[d:d+1] == '.' and s[d+1:d+2].isspace():
+        return f'<div class="blt">{_inline(s)}</div>'
+    return _inline(line)
+
+def render_ai(text: str, split: bool = True):
+    # Single pass over the lines. Fences switch a code state (code is escaped
+    # verbatim), other lines get block + inline formatting, and with split=True
+    # thought sections are routed to their own output. Returns (main_html,
+    # thought_html or None); lines are joined with <br> as st.markdown needs.
+    main, thought, in_t = [], [], False
+    out, item, lang, code, opened = main, "", None, [], None
     for line in text.split('\n'):
-        s = line.strip()
-        if any(s.startswith(ic) for ic in SECTION_ICONS):
-            out.append(f'<span class="shdr">{s}</span>')
-        elif re.match(r'^[•\-\*]\s', s) and not s.startswith('**'):
-            out.append(f'<div class="blt">▸ {s[2:]}</div>')
-        elif re.match(r'^\d+\.\s', s):
-            out.append(f'<div class="blt">{s}</div>')
+        if lang is None:
+            s = line.strip()
+            if split and s.startswith(THOUGHT_MARKERS):
+                in_t = True
+            out = thought if in_t else main
+            if FENCE not in line:
+                out.append(_line_html(line))
+                if in_t and not s and len(thought) > 1:
+                    in_t = False
+                continue
+            item, opened = "", (out, [])
+        opened[1].append(line)
+        rest = line
+        while True:
+            i = rest.find(FENCE)
+            if lang is None:
+                if i < 0:
+                    item += _inline(rest)
+                    break
+                item += _inline(rest[:i])
+                lang  = FENCE_RE.match(rest, i + 3).group(0)
+                rest  = rest[i + 3 + len(lang):]
+                code  = []
+                if not rest:
+                    break
+            elif i < 0:
+                code.append(rest)
+                break
+            else:
+                code.append(rest[:i])
+                item += code_block_html(lang, '\n'.join(code))
+                lang, rest = None, rest[i + 3:]
+        if lang is None:
+            out.append(item)
+            if in_t and not line.strip() and len(thought) > 1:
+                in_t = False
+    if lang is not None:
+        # Unterminated fence: show those lines as plain text, like the markdown would.
+        opened[0].extend(_line_html(l) for l in opened[1])
+    if not thought:
+        return '<br>'.join(main), None
+    while main and not main[0].strip():
+        main.pop(0)
+    while main and not main[-1].strip():
+        main.pop()
+    return '<br>'.join(main), THOUGHT_HDR + '<br>'.join(thought) + '</div>'
+
+def format_ai_text(text: str) -> str:
+    return render_ai(text, split=False)[0]
+
+class StreamRenderer:
+    # Live view for handle_send. Complete lines outside code, and whole code
+    # blocks once their closing fence arrives, go through format_ai_text exactly
+    # once; a frame only re-renders the unfinished line (or the open code block,
+    # whose lines are escaped once as they complete).
+    def __init__(self):
+        self._parts = []     # raw tokens, joined once in .text
+        self._line  = ""     # current incomplete line
+        self._ready = []     # complete lines outside code, not yet formatted
+        self._done  = []     # formatted HTML chunks, never touched again
+        self._lang  = None   # language of the open fence, None outside code
+        self._pre   = ""     # text before the open fence on its line
+        self._block = []     # raw lines of the open code block
+        self._code  = []     # escaped lines of the open code block
+
+    @property
+    def text(self) -> str:
+        return ''.join(self._parts)
+
+    def feed(self, tok: str):
+        self._parts.append(tok)
+        *lines, self._line = (self._line + tok).split('\n')
+        for ln in lines:
+            self._push(ln + '\n')
+        self._flush()
+
+    def _flush(self):
+        if self._ready:
+            self._done.append(format_ai_text(''.join(self._ready)))
+            self._ready = []
+
+    def _push(self, ln: str):
+        odd = ln.count(FENCE) % 2
+        if self._lang is None:
+            if not odd:
+                self._ready.append(ln)
+                return
+            self._flush()
+            i = ln.rfind(FENCE)
+            self._pre, self._lang = ln[:i], FENCE_RE.match(ln, i + 3).group(0)
+            self._block, self._code = [ln], []
+        elif odd:
+            self._block.append(ln)
+            self._done.append(format_ai_text(''.join(self._block)))
+            self._lang, self._block, self._code = None, [], []
+        else:
+            self._block.append(ln)
+            self._code.append(_esc(ln[:-1]))
+
+    def html(self) -> str:
+        if self._lang is None:
+            tail = format_ai_text(self._line)
+        elif FENCE in self._line:
+            tail = format_ai_text(''.join(self._block) + self._line)
         else:
-            out.append(line)
-    return '<br>'.join(out)
-
-def split_thoughts(text: str):
-    markers = [
-        '🔍 Problem Breakdown','🔍 ANALYSIS','💡 Approach','💡 APPROACH',
-        '⚙️ Implementation','⚙️ SOLUTION','✅ Test Cases','✅ VERIFICATION',
-        '🚀 Optimisations','🚀 OPTIMISATION','🐛 Root Cause','🔬 Analysis',
-        '🔧 Fix','🔧 Fixed Code','🧪 Prevention','[ANALYSIS]','[APPROACH]',
+            body = '<br>'.join(self._code + [_esc(self._line)])
+            tail = format_ai_text(self._pre) + code_window_html(self._lang, body)
+        return ''.join(self._done) + tail
+
+# ═══════════════════════════════════════════════════════════════════════
+#  RENDER CACHE
+# ═══════════════════════════════════════════════════════════════════════
+class LRUCache:
+    # Thread-safe LRU bounded by the summed size of its values.
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self.size     = 0
+        self.hits     = 0
+        self.misses   = 0
+        self._d       = OrderedDict()
+        self._lock    = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            hit = self._d.get(key)
+            if hit is None:
+                self.misses += 1
+                return None
+            self._d.move_to_end(key)
+            self.hits += 1
+            return hit[0]
+
+    def put(self, key, value, size: int):
+        with self._lock:
+            if key in self._d:
+                self.size -= self._d.pop(key)[1]
+            self._d[key] = (value, size)
+            self.size   += size
+            while self.size > self.max_size and len(self._d) > 1:
+                self.size -= self._d.popitem(last=False)[1][1]
+
+    def __len__(self):
+        return len(self._d)
+
+@st.cache_resource
+def render_cache() -> LRUCache:
+    return LRUCache(RENDER_CACHE_MB * 1024 * 1024)
+
+def debug_items(meta: dict) -> list:
+    items = [
+        f'⏱ {meta.get("elapsed","?")}s elapsed',
+        f'✎ {meta.get("chars",0)} chars',
+        f'◈ {meta.get("mode","?")} mode',
     ]
-    thought, main, in_t = [], [], False
-    for line in text.split('\n'):
-        if any(line.strip().startswith(m) for m in markers):
-            in_t = True
-        (thought if in_t else main).append(line)
-        if in_t and line.strip() == '' and len(thought) > 1:
-            in_t = False
-    if not thought:
-        return text, None
-    return (
-        '\n'.join(main).strip(),
-        '<div class="thgt"><span class="thgt-h">◈ NEURAL THOUGHT PROCESS</span>'
-        + '\n'.join(thought).replace('\n','<br>') + '</div>'
+    if "ctx_tokens" in meta:
+        items.append(f'⧉ ~{meta["ctx_tokens"]:,} ctx tokens')
+    if "summarized" in meta:
+        items.append(f'≡ {meta["summarized"]} earlier msgs as summary')
+    if "retrieved" in meta:
+        items.append(f'⌕ {len(meta["retrieved"])} project chunks: {_esc(", ".join(meta["retrieved"]))}')
+    if "map" in meta:
+        items.append(f'⧉ map-reduce over {meta["map"]["parts"]} parts ({meta["map"]["seconds"]}s'
+                     + (f', {meta["map"]["failed"]} failed)' if meta["map"]["failed"] else ')'))
+    if meta.get("cache") == "hit":
+        items.append('⟳ cached answer')
+    elif meta.get("cache") == "semantic":
+        items.append(f'⟳ similar question cached (cos {meta.get("similarity", "?")})')
+    if "prompt_eval" in meta:
+        items.append(f'⟲ {meta["prompt_eval"]:,} prompt-eval ({meta["reuse_pct"]}% cached)')
+    if "truncated" in meta:
+        items.append(f'✂ truncated ({meta["truncated"]})')
+    if "ttft" in meta:
+        items.append(f'⚡ {meta["ttft"]}s to first token')
+    if "decode_s" in meta:
+        items.append(f'⧗ load {meta.get("load_s", 0)}s · prompt {meta.get("prompt_s", 0)}s · '
+                     f'decode {meta["decode_s"]}s ({meta.get("tok_s", "?")} tok/s)')
+    if "num_predict" in meta:
+        items.append(f'⌗ {meta.get("eval_count", "?")} / {meta["num_predict"]:,} reply tokens')
+    model = meta.get("model", MODEL).rsplit("/", 1)[-1].lower()
+    where = f' @ {meta["backend"]}' if "backend" in meta else ''
+    items.append((f'⬡ {meta["route"]} → {model}' if "route" in meta else f'⬡ {model}') + where)
+    return items
+
+def render_ai_html(content: str, ts: str, meta: dict, show_thoughts: bool, debug_mode: bool) -> str:
+    # Two levels: the expensive split/format is keyed on content alone, so a
+    # display toggle only reassembles strings; the assembled card adds the flags.
+    cache = render_cache()
+    h     = hashlib.sha1(content.encode()).hexdigest()
+    key   = (h, hashlib.sha1(f"{ts}\0{json.dumps(meta, sort_keys=True, default=str)}".encode()).hexdigest(),
+             show_thoughts, debug_mode)
+    html  = cache.get(key)
+    if html is not None:
+        return html
+
+    parts = cache.get(h)
+    if parts is None:
+        parts = render_ai(content)
+        cache.put(h, parts, len(parts[0]) + len(parts[1] or ""))
+    formatted, thought_html = parts
+
+    t_sec = thought_html if thought_html and show_thoughts else ""
+    d_sec = ""
+    if debug_mode and meta:
+        d_sec = f'<div class="dinfo">{" &nbsp;|&nbsp; ".join(debug_items(meta))}</div>'
+    html = (
+        f'<div class="mwrap"><div class="mai"><span class="lai">⚡ CYBERBOT</span>'
+        f'{t_sec}'
+        f'<div class="mbody">{formatted}</div>'
+        f'{d_sec}'
+        f'<div class="mts">{ts}</div></div></div>'
     )
+    cache.put(key, html, len(html))
+    return html
 
 # ═══════════════════════════════════════════════════════════════════════
 #  OLLAMA
 # ═══════════════════════════════════════════════════════════════════════
-def check_ollama() -> bool:
-    if not OLLAMA_PKG:
-        return False
+def ollama_hosts() -> list:
+    # CYBERBOT_OLLAMA_HOSTS="gpu1:11434,gpu2:11434" spreads requests over several
+    # Ollama servers; otherwise the single OLLAMA_HOST the client library uses.
+    # Read at call time so benches can point the env at a fake first.
+    hosts = [h.strip() for h in os.environ.get("CYBERBOT_OLLAMA_HOSTS", "").split(",") if h.strip()]
+    return hosts or [os.environ.get("OLLAMA_HOST") or "127.0.0.1:11434"]
+
+class OllamaMonitor:
+    # Process-wide background prober. Render code reads the last snapshot
+    # instead of making its own blocking round trip on every rerun.
+    def __init__(self, ttl: float, timeout: float):
+        self.ttl     = ttl
+        self.online  = None     # None until the first probe completes
+        self.latency = 0.0      # ms for the last successful probe
+        self.models  = []       # installed models
+        self.loaded  = []       # models currently in memory
+        self.error   = ""
+        self.checked = 0.0
+        self.hosts   = {}       # host -> reachable at the last probe
+        self._wake   = threading.Event()
+        self._ready  = threading.Event()
+        if not OLLAMA_PKG:
+            self.online, self.error = False, "ollama package missing"
+            self._ready.set()
+            return
+        self._clients = {h: _ollama.Client(host=h, timeout=timeout) for h in ollama_hosts()}
+        threading.Thread(target=self._run, name="ollama-monitor", daemon=True).start()
+
+    def _probe(self):
+        # Online if any host answers; models are the union over those that do.
+        models, loaded, lat, errors, hosts = set(), set(), [], [], {}
+        for host, client in self._clients.items():
+            t0 = time.perf_counter()
+            try:
+                models.update(m.model for m in client.list().models)
+                loaded.update(m.model for m in client.ps().models)
+                lat.append(round((time.perf_counter() - t0) * 1000, 1))
+                hosts[host] = True
+            except Exception as exc:
+                errors.append(f"{host}: {exc}")
+                hosts[host] = False
+        self.hosts, self.models, self.loaded, self.error = hosts, sorted(models), sorted(loaded), "; ".join(errors)
+        self.online  = any(hosts.values())
+        self.latency = min(lat) if lat else 0.0
+        self.checked = time.time()
+        self._ready.set()
+
+    def _run(self):
+        while True:
+            self._probe()
+            self._wake.wait(self.ttl)
+            self._wake.clear()
+
+    def wait(self, timeout: float) -> bool:
+        # Only blocks before the very first probe has finished.
+        self._ready.wait(timeout)
+        return bool(self.online)
+
+    def invalidate(self):
+        self.online = False
+        self._wake.set()
+
+    def refresh(self):
+        self._wake.set()
+
+@st.cache_resource
+def ollama_monitor() -> OllamaMonitor:
+    return OllamaMonitor(HEALTH_TTL, PROBE_TIMEOUT)
+
+class ModelWarmer:
+    # Loads the routed models before the first TRANSMIT and keeps them resident
+    # while any session is active. Once every session has been idle for
+    # SESSION_IDLE it stops refreshing and Ollama unloads them after KEEP_ALIVE.
+    def __init__(self, monitor: OllamaMonitor, sched: "Scheduler"):
+        self.monitor  = monitor
+        self.sched    = sched
+        self.state    = "cold"     # cold | loading | hot
+        self.active   = time.time()
+        self.loaded_s = 0.0        # duration of the last load, seconds
+        self._last    = 0.0        # last successful preload / refresh
+        self._wake    = threading.Event()
+        if OLLAMA_PKG:
+            threading.Thread(target=self._run, name="model-warmer", daemon=True).start()
+
+    def touch(self):
+        idle, self.active = time.time() - self.active > SESSION_IDLE, time.time()
+        if idle or self.state == "cold":
+            self._wake.set()
+
+    def _preload(self):
+        self.state = "loading"
+        t0 = time.perf_counter()
+        try:
+            # Runs on the scheduler loop so it reuses the pooled clients.
+            for b in self.sched.pool.backends:
+                if self.monitor.hosts.get(b.host) is not False:
+                    asyncio.run_coroutine_threadsafe(self._load(b), self.sched.loop).result()
+            self.loaded_s, self._last, self.state = round(time.perf_counter() - t0, 2), time.time(), "hot"
+            self.monitor.refresh()
+        except Exception:
+            self.state = "cold"
+
+    async def _load(self, backend: "Backend"):
+        # Same num_ctx as stream_response, otherwise Ollama reloads on first use.
+        for model in ROUTE_MODELS:
+            await backend.client().generate(model=model, prompt="", keep_alive=KEEP_ALIVE, options={"num_ctx": NUM_CTX})
+
+    def _run(self):
+        while True:
+            now = time.time()
+            if self.monitor.online and now - self.active < SESSION_IDLE:
+                resident = all(m in self.monitor.loaded for m in ROUTE_MODELS)
+                if not resident or now - self._last > KEEP_ALIVE / 2:
+                    self._preload()
+            elif not any(m in self.monitor.loaded for m in ROUTE_MODELS):
+                self.state = "cold"
+            self._wake.wait(HEALTH_TTL * 3)
+            self._wake.clear()
+
+    def mark_used(self):
+        # A chat request refreshes keep_alive itself.
+        self._last, self.state = time.time(), "hot"
+
+@st.cache_resource
+def model_warmer() -> ModelWarmer:
+    return ModelWarmer(ollama_monitor(), scheduler())
+
+def est_tokens(text: str) -> int:
+    # No tokenizer ships with the client; chars/token plus chat-template overhead.
+    return int(len(text) / CHARS_PER_TOKEN) + 4
+
+def msgs_tokens(msgs: list) -> int:
+    return sum(est_tokens(m["content"]) for m in msgs)
+
+def prompt_budget(num_predict: int = NUM_PREDICT) -> int:
+    return NUM_CTX - num_predict
+
+TRUNC_MARK = "[…earlier part truncated to fit the context window…]\n"
+
+def _clip(text: str, tokens: int, keep_head: bool = False) -> str:
+    n = max(0, int((tokens - 4) * CHARS_PER_TOKEN) - len(TRUNC_MARK))
+    if n >= len(text):
+        return text
+    if keep_head:
+        return text[:n // 2] + "\n" + TRUNC_MARK + text[-(n - n // 2):]
+    return TRUNC_MARK + text[-n:] if n else TRUNC_MARK
+
+def fit_start(history: list, user_text: str, mode: str, start: int = 0, budget: int = None, summary: str = "") -> int:
+    # Pinned window start. Ollama reuses its KV cache for the longest unchanged
+    # prompt prefix, so the window must not slide one turn at a time: keep
+    # `start` while everything after it fits, otherwise jump forward so only
+    # CTX_REFILL of the budget is used and the next few turns append to a
+    # stable prefix again. The last exchange is always kept: if it does not
+    # fit whole, its older turn stays in the window and build_msgs clips it.
+    room  = (budget or prompt_budget()) - est_tokens(system_prompt(mode, summary)) - est_tokens(user_text)
+    costs = [est_tokens(m["content"]) for m in history]
+    start = min(max(start, 0), len(history))
+    if sum(costs[start:]) <= room and len(history) - start <= MAX_HISTORY * 2:
+        return start
+    target, used, i = min(room * CTX_REFILL, room), 0, len(history)
+    while i > start and used + costs[i - 1] <= room and (
+            used + costs[i - 1] <= target or len(history) - i < 2) and len(history) - i < MAX_HISTORY:
+        i    -= 1
+        used += costs[i]
+    if i > start and len(history) - i < 2 and used + costs[i - 1] > room and room - used >= 64:
+        return i - 1                            # partly fits; build_msgs keeps its tail
+    while i < len(history) - 1 and history[i]["role"] != "user":
+        i += 1
+    return i
+
+def system_prompt(mode: str, summary: str = "") -> str:
+    # The rolling summary rides on the system prompt so the prefix Ollama
+    # caches only changes when the summary does.
+    return MODE_PROMPTS.get(mode, BASE_SYSTEM) + (SUMMARY_HEAD + summary if summary else "")
+
+def build_msgs(history: list, user_text: str, mode: str, budget: int = None, start: int = 0, summary: str = "") -> list:
+    # Turns from `start` on (see fit_start), newest first until the token budget
+    # is spent; the oldest turn that does not fit keeps its tail if enough room
+    # is left, older ones are dropped. Included turns are sent verbatim.
+    budget = budget or prompt_budget()
+    system = system_prompt(mode, summary)
+    left   = budget - est_tokens(system)
+    if est_tokens(user_text) > left:
+        user_text = _clip(user_text, left, keep_head=True)
+    left  -= est_tokens(user_text)
+    turns  = []
+    for m in reversed(history[start:][-MAX_HISTORY * 2:]):
+        cost = est_tokens(m["content"])
+        if cost > left:
+            if left >= 64:
+                turns.append({"role": m["role"], "content": _clip(m["content"], left)})
+            break
+        turns.append({"role": m["role"], "content": m["content"]})
+        left -= cost
+    return [{"role": "system", "content": system}, *reversed(turns), {"role": "user", "content": user_text}]
+
+STAT_FIELDS = ("prompt_eval_count", "prompt_eval_duration", "eval_count", "eval_duration",
+               "load_duration", "total_duration", "done_reason")
+# num_ctx is shared on purpose: Ollama reloads the model whenever it changes.
+SAMPLING     = {"top_p":0.92,"top_k":40,"repeat_penalty":1.1,"num_ctx":NUM_CTX}
+GEN_PROFILES = {
+    "Normal":       {"temperature":0.65, "num_predict":1024,        "stop":[]},
+    "Deep Thought": {"temperature":0.7,  "num_predict":3072,        "stop":[]},
+    "Code Master":  {"temperature":0.4,  "num_predict":NUM_PREDICT, "stop":[]},
+    "Debug":        {"temperature":0.3,  "num_predict":NUM_PREDICT, "stop":[]},
+}
+
+class ReplyBudget:
+    # Learned num_predict per mode. Once a mode has ADAPT_MIN answers its
+    # limit is ADAPT_HEADROOM × the p95 completion length (rounded up to 256),
+    # so short-answer modes stop reserving context for tokens they never
+    # produce. A reply cut off by the limit raises the mode's floor to twice
+    # its length, so one miss is enough to grow it back.
+    def __init__(self, window: int = 200):
+        self._lens  = {}                        # mode -> deque of eval_count
+        self._floor = {}
+        self._lock  = threading.Lock()
+        self.window = window
+
+    def limit(self, mode: str, cap: int) -> int:
+        with self._lock:
+            lens  = sorted(self._lens.get(mode, ()))
+            floor = self._floor.get(mode, ADAPT_FLOOR)
+        if len(lens) < ADAPT_MIN:
+            return cap
+        p95 = lens[min(len(lens) - 1, int(len(lens) * 0.95))]
+        return min(cap, max(floor, -(-int(p95 * ADAPT_HEADROOM) // 256) * 256))
+
+    def observe(self, mode: str, stats: dict):
+        n, reason = stats.get("eval_count"), stats.get("done_reason")
+        if not n or reason not in ("stop", "length"):
+            return                              # cache hits, STOP and timeouts say nothing about length
+        with self._lock:
+            self._lens.setdefault(mode, deque(maxlen=self.window)).append(n)
+            if reason == "length":
+                self._floor[mode] = max(self._floor.get(mode, ADAPT_FLOOR), 2 * n)
+
+@st.cache_resource
+def reply_budget() -> ReplyBudget:
+    return ReplyBudget()
+
+def gen_options(mode: str, override: dict = None) -> dict:
+    # The mode's profile with per-session overrides on top. With "adaptive"
+    # on (the default) num_predict is the learned limit, capped by the profile.
+    prof = {**GEN_PROFILES.get(mode, GEN_PROFILES["Normal"]), **(override or {})}
+    if prof.pop("adaptive", True):
+        prof["num_predict"] = reply_budget().limit(mode, prof["num_predict"])
+    return {**SAMPLING, **prof}
+
+ROUTES       = {"fast": FAST_MODEL, "strong": STRONG_MODEL}
+ROUTE_MODELS = list(dict.fromkeys(ROUTES.values()))
+HEAVY_RE     = re.compile(r'\b(refactor|implement|rewrite|debug|traceback|stack ?trace|exception|optimi[sz]e|'
+                          r'architect\w*|design|concurren\w*|thread\w*|async|race|deadlock|memory leak|'
+                          r'algorithm|complexity|prove|migrat\w*|full|entire|whole|multi-?file)\b', re.I)
+LIGHT_RE     = re.compile(r'^\s*(what|who|when|which|define|explain briefly|how do i|is there|does)\b', re.I)
+
+class Router:
+    # Picks a model per request from cheap signals only (no model call):
+    # mode, prompt size, fenced code blocks and a few keywords. Heavy
+    # Code Master / Debug work scores ROUTE_SCORE or more and goes to the
+    # strong model, short lookups to the fast one. Keeps per-route traffic
+    # and latency for the debug panel.
+    MODE_SCORE = {"Normal": 0, "Deep Thought": 1, "Code Master": 2, "Debug": 2}
+
+    def __init__(self, routes: dict, window: int = 200):
+        self.routes = routes
+        self.counts = {r: 0 for r in routes}
+        self._lat   = {r: deque(maxlen=window) for r in routes}
+        self._lock  = threading.Lock()
+
+    @classmethod
+    def score(cls, mode: str, text: str) -> int:
+        tokens = est_tokens(text)
+        score  = cls.MODE_SCORE.get(mode, 0)
+        score += min(3, text.count("```") // 2)
+        score += (tokens > 200) + (tokens > 800)
+        score += bool(HEAVY_RE.search(text))
+        if tokens < 40 and "```" not in text and LIGHT_RE.match(text):
+            score -= 1
+        return score
+
+    def pick(self, mode: str, text: str) -> str:
+        return "strong" if self.score(mode, text) >= ROUTE_SCORE else "fast"
+
+    def record(self, meta: dict):
+        route = meta.get("route")
+        if route not in self.routes:
+            return
+        with self._lock:
+            self.counts[route] += 1
+            if meta.get("cache") == "miss":     # replayed answers would flatter the route
+                self._lat[route].append(meta["elapsed"])
+
+    def summary(self) -> list:
+        # (route, model, share of requests, p50 / p95 seconds) per route.
+        total, rows = sum(self.counts.values()) or 1, []
+        with self._lock:
+            for r, model in self.routes.items():
+                lat = sorted(self._lat[r])
+                p   = lambda q: lat[min(len(lat) - 1, int(len(lat) * q))] if lat else None
+                rows.append((r, model, self.counts[r] / total, p(0.5), p(0.95)))
+        return rows
+
+@st.cache_resource
+def router() -> Router:
+    return Router(ROUTES)
+
+class Backend:
+    # One Ollama host: a persistent AsyncClient (its HTTP connections stay
+    # open between requests) and the load/latency the pool routes on. Only
+    # connecting is bounded; a model load or a long answer may take minutes.
+    def __init__(self, host: str):
+        self.host       = host
+        self.inflight   = 0
+        self.served     = 0
+        self.failed     = 0
+        self.down_until = 0.0
+        self.ttft       = deque(maxlen=100)     # seconds to the first chunk
+        self._client    = None
+        self._sync      = None
+
+    def client(self):
+        if self._client is None:                # created on the scheduler loop
+            self._client = _ollama.AsyncClient(host=self.host, timeout=httpx.Timeout(None, connect=PROBE_TIMEOUT))
+        return self._client
+
+    def sync_client(self):
+        # Blocking client for short calls made on script threads (embeddings).
+        if self._sync is None:
+            self._sync = _ollama.Client(host=self.host, timeout=httpx.Timeout(EMBED_TIMEOUT, connect=PROBE_TIMEOUT))
+        return self._sync
+
+    def p50(self) -> float:
+        lat = sorted(self.ttft)
+        return lat[len(lat) // 2] if lat else 0.0
+
+class BackendPool:
+    # Least-outstanding-requests routing over the configured hosts. Hosts the
+    # monitor last saw offline, or that failed within BACKEND_COOLDOWN, go to
+    # the back of the order but are still tried when nothing else is left.
+    def __init__(self, hosts: list, monitor: "OllamaMonitor" = None):
+        self.backends = [Backend(h) for h in hosts]
+        self.monitor  = monitor
+
+    def healthy(self, b: Backend) -> bool:
+        if b.down_until > time.time():
+            return False
+        return self.monitor is None or self.monitor.hosts.get(b.host) is not False
+
+    def order(self) -> list:
+        return sorted(self.backends, key=lambda b: (not self.healthy(b), b.inflight, b.p50()))
+
+    def fail(self, b: Backend):
+        b.failed    += 1
+        b.down_until = time.time() + BACKEND_COOLDOWN
+
+class Scheduler:
+    # Process-wide admission control for model calls. One asyncio loop on its
+    # own thread runs at most `limit` Ollama streams at once; the rest wait in
+    # per-session queues that are served round-robin, so one busy session
+    # cannot starve the others. All queue state is only touched on the loop.
+    def __init__(self, limit: int, pool: BackendPool):
+        self.limit     = limit
+        self.pool      = pool
+        self.running   = 0
+        self.waiting   = 0
+        self.served    = 0
+        self.cancelled = 0
+        self.timeouts  = 0
+        self._queues   = OrderedDict()          # session -> deque of waiter futures
+        self.loop      = asyncio.new_event_loop()
+        threading.Thread(target=self.loop.run_forever, name="cyberbot-scheduler", daemon=True).start()
+
+    def _position(self, session: str, fut) -> int:
+        # 1-based: own place in line plus one turn for each other session ahead of it.
+        i = self._queues[session].index(fut)
+        return 1 + i + sum(min(len(q), i + 1) for s, q in self._queues.items() if s != session)
+
+    async def _acquire(self, session: str, on_wait=None):
+        if self.running < self.limit and not self._queues:
+            self.running += 1
+            return
+        fut = self.loop.create_future()
+        self._queues.setdefault(session, deque()).append(fut)
+        self.waiting += 1
+        try:
+            while not fut.done():
+                if on_wait:
+                    on_wait(self._position(session, fut))
+                await asyncio.wait([fut], timeout=1.0)
+        except BaseException:
+            if fut.done():
+                self._release()                 # the slot was already handed to us
+            else:
+                fut.cancel()
+                q = self._queues[session]
+                q.remove(fut)
+                if not q:
+                    del self._queues[session]
+            raise
+        finally:
+            self.waiting -= 1
+
+    def _release(self):
+        # Hand the slot straight to the next session in rotation.
+        while self._queues:
+            session, q = next(iter(self._queues.items()))
+            fut = q.popleft()
+            if q:
+                self._queues.move_to_end(session)
+            else:
+                del self._queues[session]
+            if not fut.done():
+                fut.set_result(None)
+                return
+        self.running -= 1
+
+    async def stream(self, session: str, messages: list, stats: dict = None, on_wait=None, options: dict = None,
+                     model: str = MODEL):
+        # Async token generator; closing it closes the HTTP stream, which makes
+        # Ollama stop decoding and frees the slot for the next session.
+        await self._acquire(session, on_wait)
+        try:
+            options = options or gen_options("Normal")
+            if stats is not None:
+                stats["num_predict"] = options["num_predict"]
+            deadline = self.loop.time() + GEN_TIMEOUT
+            resp, chunk, backend = await self._open(model, messages, options, deadline)
+            if stats is not None:
+                stats["backend"] = backend.host
+            try:
+                while True:
+                    if chunk is None:
+                        # Give up on a runaway or stalled stream; closing it stops decoding.
+                        self.timeouts += 1
+                        if stats is not None:
+                            stats["done_reason"] = "timeout"
+                        break
+                    tok = chunk.get("message",{}).get("content","")
+                    if tok:
+                        yield tok
+                    if chunk.get("done") and stats is not None:
+                        stats.update({k: chunk.get(k) for k in STAT_FIELDS})
+                    try:
+                        chunk = await asyncio.wait_for(resp.__anext__(), deadline - self.loop.time())
+                    except StopAsyncIteration:
+                        break
+                    except asyncio.TimeoutError:
+                        chunk = None
+            finally:
+                backend.inflight -= 1
+                await resp.aclose()
+            backend.served += 1
+            self.served    += 1
+        finally:
+            self._release()
+
+    async def _open(self, model: str, messages: list, options: dict, deadline: float):
+        # Start the stream on the least busy healthy backend and wait for its
+        # first chunk. A host that errors before that (down, model missing,
+        # connection reset) is benched and the next one is tried; once tokens
+        # flow, errors go to the caller. Returns (stream, first chunk, backend);
+        # the chunk is None when the first wait ran into GEN_TIMEOUT.
+        error = None
+        for backend in self.pool.order():
+            backend.inflight += 1
+            t0, resp, ok = self.loop.time(), None, False
+            try:
+                resp = await backend.client().chat(
+                    model=model, messages=messages, stream=True, keep_alive=KEEP_ALIVE, options=options,
+                )
+                try:
+                    first = await asyncio.wait_for(resp.__anext__(), deadline - self.loop.time())
+                except asyncio.TimeoutError:
+                    first = None
+                backend.ttft.append(self.loop.time() - t0)
+                ok = True
+                return resp, first, backend
+            except Exception as exc:
+                self.pool.fail(backend)
+                error = exc
+            finally:
+                if not ok:
+                    backend.inflight -= 1
+                    if resp is not None:
+                        await resp.aclose()
+        raise error
+
+    def submit(self, session: str, messages: list, stats: dict = None, options: dict = None,
+               model: str = MODEL) -> "Ticket":
+        ticket = Ticket()
+        ticket.future = asyncio.run_coroutine_threadsafe(
+            self._pump(ticket, session, messages, stats, options, model), self.loop)
+        return ticket
+
+    async def _pump(self, ticket, session, messages, stats, options, model):
+        def on_wait(pos):
+            ticket.check()
+            ticket.put(("queued", pos))
+        gen = self.stream(session, messages, stats, on_wait, options, model)
+        try:
+            async for tok in gen:
+                ticket.check()
+                ticket.put(("tok", tok))
+            ticket.put(("done", None))
+        except (asyncio.CancelledError, ClientGone):
+            self.cancelled += 1
+        except Exception as exc:
+            ticket.put(("error", exc))
+        finally:
+            await gen.aclose()
+
+class ClientGone(Exception):
+    pass
+
+class Ticket:
+    # Thread-safe handle between a script thread and the scheduler loop. The
+    # consumer stamps `polled` while it reads; a request whose reader has gone
+    # quiet for CLIENT_TIMEOUT (closed tab, killed rerun) is cancelled.
+    def __init__(self):
+        self.q      = queue.Queue()
+        self.polled = time.monotonic()
+        self.future = None
+
+    def put(self, event):
+        self.q.put(event)
+
+    def check(self):
+        if time.monotonic() - self.polled > CLIENT_TIMEOUT:
+            raise ClientGone()
+
+    def cancel(self):
+        if self.future is not None and not self.future.done():
+            self.future.cancel()
+
+    def events(self):
+        while True:
+            self.polled = time.monotonic()
+            try:
+                event = self.q.get(timeout=1.0)
+            except queue.Empty:
+                if self.future.done():
+                    return
+                continue
+            yield event
+            if event[0] in ("done", "error"):
+                return
+
+@st.cache_resource(show_spinner=False)
+def scheduler() -> Scheduler:
+    return Scheduler(MAX_CONCURRENT, BackendPool(ollama_hosts(), ollama_monitor()))
+
+def stream_response(messages: list, stats: dict = None, session: str = "-", on_wait=None, options: dict = None,
+                    model: str = MODEL):
+    ticket = scheduler().submit(session, messages, stats, options, model)
     try:
-        _ollama.list()
-        return True
-    except Exception:
-        return False
-
-def build_msgs(history: list, user_text: str, mode: str) -> list:
-    msgs = [{"role": "system", "content": MODE_PROMPTS.get(mode, BASE_SYSTEM)}]
-    for m in history[-MAX_HISTORY:]:
-        msgs.append({"role": m["role"], "content": m["content"]})
-    msgs.append({"role": "user", "content": user_text})
-    return msgs
-
-def stream_response(messages: list):
-    stream = _ollama.chat(
-        model=MODEL, messages=messages, stream=True,
-        options={"temperature":0.65,"top_p":0.92,"top_k":40,
-                 "repeat_penalty":1.1,"num_predict":4096,"stop":[]},
-    )
-    for chunk in stream:
-        tok = chunk.get("message",{}).get("content","")
-        if tok:
+        for kind, value in ticket.events():
+            if kind == "tok":
+                yield value
+            elif kind == "queued":
+                if on_wait:
+                    on_wait(value)
+            elif kind == "error":
+                raise value
+    finally:
+        ticket.cancel()
+
+# ═══════════════════════════════════════════════════════════════════════
+#  RESPONSE CACHE
+# ═══════════════════════════════════════════════════════════════════════
+class ResponseCache:
+    # Exact-match answer cache in SQLite, shared by every session and kept
+    # across restarts. Rows past ttl are dropped on read; beyond max_bytes the
+    # least recently used rows are evicted.
+    def __init__(self, path: str, max_bytes: int, ttl: float):
+        self.max_bytes, self.ttl = max_bytes, ttl
+        self.hits = self.misses = 0
+        self._lock = threading.Lock()
+        self._db   = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("CREATE TABLE IF NOT EXISTS responses ("
+                         "key TEXT PRIMARY KEY, text TEXT, size INTEGER, created REAL, used REAL)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS responses_used ON responses(used)")
+        self.size = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+
+    @staticmethod
+    def key(model: str, mode: str, options: dict, msgs: list) -> str:
+        norm = [(m["role"], " ".join(m["content"].split())) for m in msgs]
+        return hashlib.sha256(json.dumps([model, mode, options, norm], sort_keys=True).encode()).hexdigest()
+
+    def get(self, key: str):
+        now = time.time()
+        with self._lock:
+            row = self._db.execute("SELECT text, size, created FROM responses WHERE key=?", (key,)).fetchone()
+            if row and now - row[2] > self.ttl:
+                self._db.execute("DELETE FROM responses WHERE key=?", (key,))
+                self.size -= row[1]
+                row = None
+            if row is None:
+                self.misses += 1
+                return None
+            self._db.execute("UPDATE responses SET used=? WHERE key=?", (now, key))
+            self.hits += 1
+            return row[0]
+
+    def put(self, key: str, text: str):
+        size, now = len(text.encode()), time.time()
+        with self._lock:
+            old = self._db.execute("SELECT size FROM responses WHERE key=?", (key,)).fetchone()
+            self._db.execute("INSERT OR REPLACE INTO responses VALUES (?,?,?,?,?)", (key, text, size, now, now))
+            self.size += size - (old[0] if old else 0)
+            if self.size > self.max_bytes:
+                self._db.execute(
+                    "DELETE FROM responses WHERE key IN (SELECT key FROM ("
+                    " SELECT key, SUM(size) OVER (ORDER BY used DESC) AS total FROM responses"
+                    ") WHERE total > ?)", (self.max_bytes,))
+                self.size = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+
+    def __len__(self):
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+
+@st.cache_resource
+def response_cache() -> ResponseCache:
+    os.makedirs(DATA_DIR, exist_ok=True)
+    return ResponseCache(os.path.join(DATA_DIR, "responses.db"), RESPONSE_CACHE_MB * 1024 * 1024, RESPONSE_CACHE_TTL)
+
+class _VecBlock:
+    # Rows of one scope: a float32 matrix grown by doubling plus parallel lists.
+    def __init__(self, dim: int):
+        self.vecs  = np.zeros((256, dim), np.float32)
+        self.used  = np.zeros(256, np.float64)
+        self.ids, self.texts = [], []
+        self.n = 0
+
+    def append(self, rid: int, text: str, vec, used: float):
+        if self.n == len(self.vecs):
+            self.vecs = np.concatenate([self.vecs, np.zeros_like(self.vecs)])
+            self.used = np.concatenate([self.used, np.zeros_like(self.used)])
+        self.vecs[self.n], self.used[self.n] = vec, used
+        self.ids.append(rid)
+        self.texts.append(text)
+        self.n += 1
+
+    def remove(self, i: int):
+        last = self.n - 1
+        self.vecs[i], self.used[i] = self.vecs[last], self.used[last]
+        self.ids[i], self.texts[i] = self.ids[last], self.texts[last]
+        self.ids.pop(); self.texts.pop()
+        self.n -= 1
+
+class SemanticIndex:
+    # Vector index over first-turn questions, one block per scope (model, mode,
+    # options) so a lookup is a single matrix-vector product over the rows that
+    # can match. Rows are persisted in SQLite and reloaded at startup; when full,
+    # the least recently used row is swap-removed.
+    def __init__(self, path: str, max_rows: int):
+        self.max_rows = max_rows
+        self.hits = self.misses = 0
+        self.n    = 0
+        self.dim  = None
+        self._blocks = {}
+        self._lock   = threading.Lock()
+        self._db     = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("CREATE TABLE IF NOT EXISTS semantic ("
+                         "id INTEGER PRIMARY KEY, scope TEXT, text TEXT, vec BLOB, used REAL)")
+        for rid, scope, text, vec, used in self._db.execute("SELECT id, scope, text, vec, used FROM semantic"):
+            self._append(rid, scope, text, np.frombuffer(vec, dtype=np.float32), used)
+
+    def _append(self, rid: int, scope: str, text: str, vec, used: float):
+        if self.dim is None:
+            self.dim = len(vec)
+        blk = self._blocks.get(scope)
+        if blk is None:
+            blk = self._blocks[scope] = _VecBlock(self.dim)
+        blk.append(rid, text, vec, used)
+        self.n += 1
+
+    def search(self, vec, scope: str, threshold: float):
+        with self._lock:
+            blk = self._blocks.get(scope)
+            if blk is None or not blk.n or len(vec) != self.dim:
+                self.misses += 1
+                return None, 0.0
+            sims = blk.vecs[:blk.n] @ vec
+            i    = int(np.argmax(sims))
+            if sims[i] < threshold:
+                self.misses += 1
+                return None, float(sims[i])
+            blk.used[i] = time.time()
+            self._db.execute("UPDATE semantic SET used=? WHERE id=?", (blk.used[i], blk.ids[i]))
+            self.hits += 1
+            return blk.texts[i], float(sims[i])
+
+    def add(self, vec, scope: str, text: str):
+        now = time.time()
+        with self._lock:
+            if self.dim is not None and len(vec) != self.dim:
+                return
+            if self.n >= self.max_rows:
+                self._evict()
+            rid = self._db.execute("INSERT INTO semantic (scope, text, vec, used) VALUES (?,?,?,?)",
+                                   (scope, text, vec.astype(np.float32).tobytes(), now)).lastrowid
+            self._append(rid, scope, text, vec, now)
+
+    def _evict(self):
+        blk = min((b for b in self._blocks.values() if b.n), key=lambda b: b.used[:b.n].min())
+        i   = int(np.argmin(blk.used[:blk.n]))
+        self._db.execute("DELETE FROM semantic WHERE id=?", (blk.ids[i],))
+        blk.remove(i)
+        self.n -= 1
+
+class SemanticCache:
+    # Paraphrase-tolerant layer in front of the model for history-free queries.
+    # Embeddings go to the scheduler's backends in pool order, each call
+    # bounded by EMBED_TIMEOUT, so a dead host costs at most that once.
+    def __init__(self, index: SemanticIndex, pool: BackendPool):
+        self.index = index
+        self.pool  = pool
+        self.error = ""
+        self._off_until = 0.0
+
+    def embed(self, text: str):
+        if time.time() < self._off_until:
+            return None
+        v = None
+        for b in self.pool.order():
+            try:
+                v = np.asarray(b.sync_client().embed(model=EMBED_MODEL, input=text).embeddings[0], dtype=np.float32)
+                break
+            except Exception as exc:
+                self.error = str(exc)
+                if not isinstance(exc, _ollama.ResponseError):
+                    self.pool.fail(b)           # unreachable, not just a missing model
+        if v is None:
+            # Embedding model missing or no host up: skip the layer for a minute.
+            self._off_until = time.time() + 60
+            return None
+        norm = float(np.linalg.norm(v))
+        return v / norm if norm else None
+
+@st.cache_resource
+def semantic_cache():
+    if not (NUMPY_PKG and OLLAMA_PKG):
+        return None
+    os.makedirs(DATA_DIR, exist_ok=True)
+    return SemanticCache(SemanticIndex(os.path.join(DATA_DIR, "responses.db"), SEMANTIC_MAX), scheduler().pool)
+
+REPLAY_RE = re.compile(r'\S+\s*|\s+')
+
+def generate(msgs: list, mode: str, stats: dict, session: str = "-", on_wait=None, options: dict = None,
+             model: str = MODEL):
+    # stream_response behind the response cache: a hit is replayed word by word
+    # through the caller's normal streaming loop, a clean miss is stored.
+    # num_predict is left out of the key: only complete answers are stored.
+    options = options or gen_options(mode)
+    keyed = {k: v for k, v in options.items() if k != "num_predict"}
+    cache = response_cache()
+    key   = cache.key(model, mode, keyed, msgs)
+    text  = cache.get(key)
+    if text is not None:
+        stats["cache"] = "hit"
+        yield from REPLAY_RE.findall(text)
+        return
+    # Paraphrases only make sense without history: system prompt + one question.
+    sem = semantic_cache() if len(msgs) == 2 else None
+    vec = sem.embed(msgs[-1]["content"]) if sem else None
+    if vec is not None:
+        scope = cache.key(model, mode, keyed, msgs[:1])
+        text, score = sem.index.search(vec, scope, SEMANTIC_THRESHOLD)
+        if text is not None:
+            stats["cache"], stats["similarity"] = "semantic", round(score, 3)
+            yield from REPLAY_RE.findall(text)
+            return
+    stats["cache"] = "miss"
+    parts  = []
+    stream = stream_response(msgs, stats, session, on_wait, options, model)
+    try:
+        for tok in stream:
+            parts.append(tok)
             yield tok
+    finally:
+        stream.close()                      # abandoned by the caller: cancel the request
+    if stats.get("done_reason") == "stop":
+        cache.put(key, ''.join(parts))
+        if vec is not None:
+            sem.index.add(vec, scope, ''.join(parts))
+
+# ═══════════════════════════════════════════════════════════════════════
+#  MAP-REDUCE DEBUG  (inputs too long for one prompt)
+# ═══════════════════════════════════════════════════════════════════════
+CODE_BLOCK_RE = re.compile(r'```.*?(```|$)', re.DOTALL)
+
+def split_input(text: str, tokens: int = MAP_CHUNK, overlap: int = MAP_OVERLAP) -> list:
+    # [(first line, last line, lines)] of about `tokens` each, 1-based; each
+    # part repeats the last `overlap` lines of the one before, so a stack
+    # trace or function cut at a boundary is seen whole at least once.
+    lines, limit, parts, i = text.splitlines(), int(tokens * CHARS_PER_TOKEN), [], 0
+    while i < len(lines):
+        j, size = i, 0
+        while j < len(lines) and (j == i or size + len(lines[j]) + 6 <= limit):
+            size += len(lines[j]) + 6           # "1234| " prefix
+            j    += 1
+        parts.append((i + 1, j, lines[i:j]))
+        if j >= len(lines):
+            break
+        k, size = j, len(lines[j]) + 6          # back off only as far as still leaves room for line j
+        while k > i + 1 and j - k < overlap and size + len(lines[k - 1]) + 6 <= limit:
+            k    -= 1
+            size += len(lines[k]) + 6
+        i = k
+    return parts
+
+def input_question(text: str) -> str:
+    # What the user asked: the prose around fenced code, else the opening lines.
+    prose = CODE_BLOCK_RE.sub(" ", text).strip() if "```" in text else ""
+    return _clip(prose or text[:600], 150, keep_head=True)
+
+def map_reduce(text: str, stats: dict, session: str, model: str, on_map, reduce):
+    # Token generator for an oversized Debug input.
+    # Map: each part goes through stream_response on MAP_PARALLEL worker
+    # threads (the scheduler still caps and interleaves them with other
+    # sessions) and `on_map(parts)` is called on this thread as they
+    # progress. Parts are short, bounded extractions, so callers pass the
+    # fast model.
+    # Reduce: `reduce(ask)` gets the merged findings and returns the answer's
+    # token generator on the routed model.
+    # Closing this generator (STOP) cancels the parts still running.
+    question = input_question(text)
+    chunks   = split_input(text)
+    parts    = [{"lines": (a, b), "status": "queued", "tokens": 0, "notes": ""} for a, b, _ in chunks]
+    opts     = {**SAMPLING, "temperature": 0.2, "num_predict": MAP_NOTES, "stop": []}
+    events   = queue.Queue()
+    cancel   = threading.Event()
+
+    def work(i: int):
+        a, b, lines = chunks[i]
+        body = _clip("\n".join(f"{a + k}| {line}" for k, line in enumerate(lines)),
+                     prompt_budget(MAP_NOTES) - est_tokens(MAP_SYSTEM) - est_tokens(question) - 32, keep_head=True)
+        msgs = [{"role": "system", "content": MAP_SYSTEM},
+                {"role": "user", "content": f"USER REQUEST:\n{question}\n\nPART {i + 1}/{len(chunks)}, lines {a}-{b}:\n{body}"}]
+        try:
+            for tok in stream_response(msgs, {}, session, options=opts, model=model):
+                if cancel.is_set():
+                    return
+                events.put((i, "tok", tok))
+            events.put((i, "done", None))
+        except Exception as exc:
+            events.put((i, "error", exc))
+
+    t0, done = time.time(), 0
+    pool = ThreadPoolExecutor(MAP_PARALLEL, thread_name_prefix="map")
+    try:
+        for i in range(len(parts)):
+            pool.submit(work, i)
+        on_map(parts)
+        while done < len(parts):
+            try:
+                i, kind, value = events.get(timeout=0.5)
+            except queue.Empty:
+                on_map(parts)
+                continue
+            p = parts[i]
+            if kind == "tok":
+                p["notes"] += value
+                p["tokens"] += 1
+                if p["status"] == "queued":
+                    p["status"] = "running"
+                    on_map(parts)
+                continue
+            done += 1
+            p["status"] = "done" if kind == "done" else "error"
+            if kind == "error":
+                p["notes"] = f"(not analysed: {value})"
+            on_map(parts)
+    finally:
+        cancel.set()
+        pool.shutdown(wait=False, cancel_futures=True)
+    stats["map"] = {"parts": len(parts), "seconds": round(time.time() - t0, 1),
+                    "failed": sum(p["status"] == "error" for p in parts)}
+
+    # Reduce: findings of every part that had any, clipped evenly to fit.
+    found = [p for p in parts if p["notes"].strip() and "nothing relevant" not in p["notes"].lower()[:40]]
+    room  = int(prompt_budget() * MAP_REDUCE_SHARE) - est_tokens(question) - 120
+    per   = max(64, room // max(1, len(found)))
+    notes = "\n\n".join(f'### lines {p["lines"][0]}-{p["lines"][1]}\n{_clip(p["notes"].strip(), per, keep_head=True)}'
+                         for p in found) or "(no part reported anything relevant)"
+    ask   = (f"The input was too long to read at once, so it was reviewed in {len(parts)} overlapping parts.\n\n"
+             f"USER REQUEST:\n{question}\n\nFINDINGS PER PART:\n{notes}\n\n"
+             "Merge these findings into one answer in the DEBUG MODE format. Under 🔧 Fixed Code give the "
+             "corrected functions or sections with their line numbers rather than the whole input.")
+    yield from reduce(ask)
+
+# ═══════════════════════════════════════════════════════════════════════
+#  TELEMETRY
+# ═══════════════════════════════════════════════════════════════════════
+def gen_meta(mode: str, msgs: list, stats: dict, elapsed: float, ttft: float, chars: int) -> dict:
+    # Per-message meta from the client clock and Ollama's final chunk
+    # (durations there are in ns), so slow answers can be split into model
+    # load, prompt eval and decoding.
+    meta = {"elapsed": elapsed, "chars": chars, "mode": mode, "ctx_tokens": msgs_tokens(msgs),
+            "cache": stats.get("cache", "miss")}
+    if "similarity" in stats:
+        meta["similarity"] = stats["similarity"]
+    if ttft is not None:
+        meta["ttft"] = round(ttft, 3)
+    if stats.get("prompt_eval_count") is not None:
+        # Ollama only counts prompt tokens it had to evaluate; the rest came from its cache.
+        meta["prompt_eval"] = stats["prompt_eval_count"]
+        meta["reuse_pct"]   = max(0, min(100, round(100 * (1 - stats["prompt_eval_count"] / meta["ctx_tokens"]))))
+    for field, key in (("eval_count", "eval_count"), ("load_duration", "load_s"),
+                       ("prompt_eval_duration", "prompt_s"), ("eval_duration", "decode_s")):
+        if stats.get(field) is not None:
+            meta[key] = stats[field] if field == "eval_count" else round(stats[field] / 1e9, 3)
+    if meta.get("eval_count") and meta.get("decode_s"):
+        meta["tok_s"] = round(meta["eval_count"] / meta["decode_s"], 1)
+    if stats.get("num_predict") is not None:
+        meta["num_predict"] = stats["num_predict"]
+    if "route" in stats:
+        meta["route"], meta["model"] = stats["route"], ROUTES[stats["route"]]
+    if "backend" in stats:
+        meta["backend"] = stats["backend"]
+    if "summarized" in stats:
+        meta["summarized"] = stats["summarized"]
+    if "retrieved" in stats:
+        meta["retrieved"] = stats["retrieved"]
+    if "map" in stats:
+        meta["map"] = stats["map"]
+    if stats.get("done_reason") in ("stopped", "timeout", "length"):
+        meta["truncated"] = stats["done_reason"]
+    return meta
+
+class Metrics:
+    # Process-wide Prometheus registry (text exposition format, no client
+    # library): request counters plus per-mode latency histograms.
+    BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+    HISTS   = {"ttft_seconds": ("ttft", "time to first token, client side"),
+               "load_seconds": ("load_s", "model load time reported by Ollama"),
+               "prompt_eval_seconds": ("prompt_s", "prompt evaluation time reported by Ollama"),
+               "eval_seconds": ("decode_s", "decoding time reported by Ollama"),
+               "request_seconds": ("elapsed", "end-to-end request time")}
+
+    def __init__(self):
+        self.lock     = threading.Lock()
+        self.hist     = {}                      # (name, mode) -> [per-bucket counts..., sum, count]
+        self.counters = {}                      # (name, labels) -> value
+
+    def inc(self, name: str, value: float = 1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name: str, mode: str, value: float):
+        with self.lock:
+            h = self.hist.setdefault((name, mode), [0] * (len(self.BUCKETS) + 2))
+            for i, b in enumerate(self.BUCKETS):
+                if value <= b:
+                    h[i] += 1
+            h[-2] += value
+            h[-1] += 1
+
+    def record(self, meta: dict):
+        mode = meta.get("mode", "?")
+        self.inc("requests_total", mode=mode, cache=meta.get("cache", "miss"))
+        for name, (key, _) in self.HISTS.items():
+            if meta.get(key) is not None:
+                self.observe(name, mode, meta[key])
+        if meta.get("prompt_eval") is not None:
+            self.inc("prompt_tokens_total", meta["prompt_eval"], mode=mode)
+        if meta.get("eval_count") is not None:
+            self.inc("completion_tokens_total", meta["eval_count"], mode=mode)
+        if "truncated" in meta:
+            self.inc("truncated_total", mode=mode, reason=meta["truncated"])
+        if "route" in meta:
+            self.inc("routed_total", route=meta["route"], model=meta["model"])
+
+    def render(self, gauges: dict = None, totals: dict = None) -> str:
+        out = []
+        with self.lock:
+            for name in sorted({n for n, _ in self.counters}):
+                out.append(f"# TYPE cyberbot_{name} counter")
+                for (n, labels), v in sorted(self.counters.items()):
+                    if n == name:
+                        out.append(f"cyberbot_{name}{{{','.join(f'{k}={json.dumps(str(x))}' for k, x in labels)}}} {v}")
+            for name, (_, help_) in self.HISTS.items():
+                rows = sorted((m, h) for (n, m), h in self.hist.items() if n == name)
+                if not rows:
+                    continue
+                out += [f"# HELP cyberbot_{name} {help_}", f"# TYPE cyberbot_{name} histogram"]
+                for mode, h in rows:
+                    lbl = f'mode={json.dumps(mode)}'
+                    out += [f'cyberbot_{name}_bucket{{{lbl},le="{b}"}} {h[i]}' for i, b in enumerate(self.BUCKETS)]
+                    out += [f'cyberbot_{name}_bucket{{{lbl},le="+Inf"}} {h[-1]}',
+                            f"cyberbot_{name}_sum{{{lbl}}} {round(h[-2], 6)}", f"cyberbot_{name}_count{{{lbl}}} {h[-1]}"]
+        for kind, values in (("gauge", gauges or {}), ("counter", totals or {})):
+            for name, v in values.items():
+                # A dict value is one series per backend host.
+                rows = [(f'{{backend={json.dumps(k)}}}', x) for k, x in v.items()] if isinstance(v, dict) else [("", v)]
+                out += [f"# TYPE cyberbot_{name} {kind}"] + [f"cyberbot_{name}{lbl} {x}" for lbl, x in rows]
+        return "\n".join(out) + "\n"
+
+    def snapshot(self) -> str:
+        sch = scheduler()
+        bks = sch.pool.backends
+        return self.render({"running": sch.running, "queued": sch.waiting, "concurrency_limit": sch.limit,
+                            "free_slots": max(0, sch.limit - sch.running),
+                            "backend_inflight": {b.host: b.inflight for b in bks},
+                            "backend_up": {b.host: int(sch.pool.healthy(b)) for b in bks},
+                            "backend_ttft_p50_seconds": {b.host: round(b.p50(), 4) for b in bks}},
+                           {"served_total": sch.served, "cancelled_total": sch.cancelled, "timeouts_total": sch.timeouts,
+                            "compactions_total": compactor().runs, "compaction_failures_total": compactor().failed,
+                            "backend_served_total": {b.host: b.served for b in bks},
+                            "backend_failed_total": {b.host: b.failed for b in bks}})
+
+@st.cache_resource(show_spinner=False)
+def metrics() -> Metrics:
+    return Metrics()
+
+@st.cache_resource(show_spinner=False)
+def metrics_server(host: str, port: int):
+    # /metrics for Streamlit mode; the headless API serves it on its own port.
+    # A failed bind is cached as None, so a taken port is reported once and
+    # the UI keeps running without metrics.
+    reg = metrics()
+
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def do_GET(self):
+            body = reg.snapshot().encode()
+            self.send_response(200 if self.path == "/metrics" else 404)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    try:
+        server = ThreadingHTTPServer((host, port), Handler)
+    except OSError as exc:
+        print(f"{APP_NAME}: /metrics not served on {host}:{port}: {exc}")
+        return None
+    threading.Thread(target=server.serve_forever, name="cyberbot-metrics", daemon=True).start()
+    return server
+
+# ═══════════════════════════════════════════════════════════════════════
+#  CONVERSATION STORE
+# ═══════════════════════════════════════════════════════════════════════
+SID_RE = re.compile(r'([A-Za-z0-9_-]{22})\.([0-9a-f]{32})')   # ?sid= link: session id . signature
+
+def new_session_id() -> str:
+    return secrets.token_urlsafe(16)
+
+@st.cache_resource(show_spinner=False)
+def sid_key() -> bytes:
+    # Server secret that signs ?sid= links, kept beside the conversations so
+    # links survive restarts. Created once with owner-only permissions.
+    os.makedirs(DATA_DIR, exist_ok=True)
+    path = os.path.join(DATA_DIR, "sid.key")
+    try:
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    except FileExistsError:
+        with open(path, "rb") as f:
+            return f.read()
+    key = secrets.token_bytes(32)
+    with os.fdopen(fd, "wb") as f:
+        f.write(key)
+    return key
+
+def sid_link(sid: str) -> str:
+    return f"{sid}.{hmac.new(sid_key(), sid.encode(), hashlib.sha256).hexdigest()[:32]}"
+
+def sid_from_link(link: str) -> str:
+    # Session id of a link this server handed out, else None: a bare, guessed
+    # or foreign id (API sessions, pre-signing links) never opens a conversation.
+    m = SID_RE.fullmatch(link or "")
+    if m and hmac.compare_digest(sid_link(m.group(1)), link):
+        return m.group(1)
+    return None
+
+class ConversationStore:
+    # Append-only message log per session_id in SQLite. The UI only keeps the
+    # active window in session_state; everything older stays on disk and is
+    # read back a page at a time. A session survives browser refreshes and
+    # restarts via its signed ?sid= URL (sid_link).
+    def __init__(self, path: str, ttl: float):
+        self._lock = threading.Lock()
+        self._db   = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute("CREATE TABLE IF NOT EXISTS messages ("
+                         "session TEXT, seq INTEGER, role TEXT, content TEXT, ts TEXT, meta TEXT, created REAL,"
+                         " PRIMARY KEY (session, seq)) WITHOUT ROWID")
+        self._db.execute("CREATE TABLE IF NOT EXISTS summaries ("
+                         "session TEXT PRIMARY KEY, upto INTEGER, text TEXT, created REAL) WITHOUT ROWID")
+        self._db.execute("DELETE FROM messages WHERE session IN (SELECT session FROM messages"
+                         " GROUP BY session HAVING MAX(created) < ?)", (time.time() - ttl,))
+        self._db.execute("DELETE FROM summaries WHERE session NOT IN (SELECT DISTINCT session FROM messages)")
+
+    @staticmethod
+    def _msg(row) -> dict:
+        msg = {"role": row[1], "content": row[2], "ts": row[3]}
+        if row[4]:
+            msg["meta"] = json.loads(row[4])
+        return msg
+
+    def append(self, session: str, msg: dict) -> int:
+        meta = json.dumps(msg["meta"]) if msg.get("meta") else None
+        with self._lock:
+            seq = self._db.execute("SELECT COALESCE(MAX(seq) + 1, 0) FROM messages WHERE session=?",
+                                   (session,)).fetchone()[0]
+            self._db.execute("INSERT INTO messages VALUES (?,?,?,?,?,?,?)",
+                             (session, seq, msg["role"], msg["content"], msg.get("ts", ""), meta, time.time()))
+            return seq
+
+    def page(self, session: str, before: int = None, limit: int = MAX_HISTORY * 2) -> tuple:
+        # Up to `limit` messages ending just before seq `before` (default: the
+        # newest), oldest first, plus the seq of the first one returned.
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT seq, role, content, ts, meta FROM messages WHERE session=? AND seq < ?"
+                " ORDER BY seq DESC LIMIT ?", (session, 2**62 if before is None else before, limit)).fetchall()
+        rows.reverse()
+        return [self._msg(r) for r in rows], (rows[0][0] if rows else before or 0)
+
+    def summary(self, session: str) -> tuple:
+        # (seq the rolling summary covers up to, exclusive; its text)
+        with self._lock:
+            row = self._db.execute("SELECT upto, text FROM summaries WHERE session=?", (session,)).fetchone()
+        return row or (0, "")
+
+    def set_summary(self, session: str, upto: int, text: str):
+        with self._lock:
+            self._db.execute("INSERT OR REPLACE INTO summaries VALUES (?,?,?,?)", (session, upto, text, time.time()))
+
+    def count(self, session: str, role: str = None) -> int:
+        with self._lock:
+            if role:
+                return self._db.execute("SELECT COUNT(*) FROM messages WHERE session=? AND role=?",
+                                        (session, role)).fetchone()[0]
+            return self._db.execute("SELECT COUNT(*) FROM messages WHERE session=?", (session,)).fetchone()[0]
+
+@st.cache_resource
+def conversation_store() -> ConversationStore:
+    os.makedirs(DATA_DIR, exist_ok=True)
+    return ConversationStore(os.path.join(DATA_DIR, "conversations.db"), CONVERSATION_TTL)
+
+class Compactor:
+    # Rolling per-session summary, built off the request path. Once more than
+    # COMPACT_AFTER exchanges follow the summary, everything but the newest
+    # COMPACT_KEEP is folded into it on a worker thread with the fast model;
+    # the next request then sends the summary instead of those turns. Each
+    # update only reads the previous summary and the new turns.
+    def __init__(self, store: ConversationStore):
+        self.store  = store
+        self.runs   = 0
+        self.failed = 0
+        self._busy  = set()
+        self._lock  = threading.Lock()
+        self._pool  = ThreadPoolExecutor(1, thread_name_prefix="compactor")
+
+    def maybe_compact(self, session: str, end: int) -> bool:
+        # `end` is the number of messages stored for the session.
+        upto, _ = self.store.summary(session)
+        target  = end - COMPACT_KEEP * 2
+        if (end - upto) // 2 <= COMPACT_AFTER or target <= upto:
+            return False
+        with self._lock:
+            if session in self._busy:
+                return False
+            self._busy.add(session)
+        self._pool.submit(self._run, session, upto, target)
+        return True
+
+    def _run(self, session: str, upto: int, target: int):
+        try:
+            msgs, _ = self.store.page(session, before=target, limit=target - upto)
+            while msgs and msgs[-1]["role"] != "assistant":      # end on a whole exchange
+                msgs.pop()
+                target -= 1
+            if not msgs:
+                return
+            _, prev = self.store.summary(session)
+            opts    = {**SAMPLING, "temperature": 0.2, "num_predict": SUMMARY_TOKENS, "stop": []}
+            per     = (prompt_budget(SUMMARY_TOKENS) - est_tokens(SUMMARY_SYSTEM) - est_tokens(prev)) // len(msgs)
+            turns   = "\n\n".join(f'{m["role"].upper()}: {_clip(m["content"], max(per, 64), keep_head=True)}'
+                                   for m in msgs)
+            prompt  = [{"role": "system", "content": SUMMARY_SYSTEM},
+                       {"role": "user", "content": f"PREVIOUS SUMMARY:\n{prev or '(none)'}\n\nNEW TURNS:\n{turns}"}]
+            stats   = {}
+            text    = ''.join(stream_response(prompt, stats, f"compact:{session}", options=opts,
+                                              model=FAST_MODEL)).strip()
+            if text and stats.get("done_reason") in ("stop", "length"):
+                self.store.set_summary(session, target, text)
+                self.runs += 1
+            else:
+                self.failed += 1
+        except Exception:
+            self.failed += 1                    # Ollama down: retried after the next turn
+        finally:
+            with self._lock:
+                self._busy.discard(session)
+
+@st.cache_resource
+def compactor() -> Compactor:
+    return Compactor(conversation_store())
+
+# ═══════════════════════════════════════════════════════════════════════
+#  PROJECT INDEX
+# ═══════════════════════════════════════════════════════════════════════
+@st.cache_resource(show_spinner=False)
+def project_index(root: str) -> ProjectIndex:
+    # One index per project root, shared by every session that attaches it.
+    os.makedirs(os.path.join(DATA_DIR, "index"), exist_ok=True)
+    key = hashlib.sha1(os.path.abspath(root).encode()).hexdigest()[:12]
+    return ProjectIndex(root, os.path.join(DATA_DIR, "index", key + ".db"))
+
+def project_path(path: str) -> str:
+    # Real path of a typed folder if it lies inside PROJECT_ROOT, else None.
+    # Any browser can type a path, so nothing outside the operator's root is
+    # ever walked, read or sent to the model.
+    if not PROJECT_ROOT or not path:
+        return None
+    base = os.path.realpath(os.path.expanduser(PROJECT_ROOT))
+    real = os.path.realpath(os.path.join(base, os.path.expanduser(path)))
+    if os.path.commonpath([base, real]) != base or not os.path.isdir(real):
+        return None
+    return real
+
+def unpack_archive(name: str, data: bytes) -> str:
+    # An uploaded .zip / .tar(.gz) goes to DATA_DIR/uploads/<content hash>, so
+    # uploading the same archive again reuses its directory and index.
+    dest = os.path.join(DATA_DIR, "uploads", hashlib.sha1(data).hexdigest()[:12])
+    if os.path.isdir(dest):
+        return dest
+    tmp = dest + ".part"
+    shutil.rmtree(tmp, ignore_errors=True)
+    os.makedirs(tmp)
+    try:
+        if name.lower().endswith(".zip"):
+            with zipfile.ZipFile(io.BytesIO(data)) as z:
+                infos = z.infolist()
+                _check_archive(len(infos), sum(i.file_size for i in infos))
+                z.extractall(tmp)               # strips absolute paths and ".." itself
+        else:
+            with tarfile.open(fileobj=io.BytesIO(data)) as t:
+                members = t.getmembers()
+                _check_archive(len(members), sum(m.size for m in members))
+                t.extractall(tmp, filter="data")    # no links or paths outside tmp
+    except BaseException:
+        shutil.rmtree(tmp, ignore_errors=True)
+        raise
+    os.replace(tmp, dest)
+    return dest
+
+def _check_archive(count: int, size: int):
+    # Sizes from the archive's own headers, checked before anything is written.
+    if count > UPLOAD_MAX_FILES:
+        raise ValueError(f"archive has {count:,} entries, more than {UPLOAD_MAX_FILES:,}")
+    if size > UPLOAD_MAX_MB * 1024 * 1024:
+        raise ValueError(f"archive expands to {size / 2**20:,.0f} MB, more than {UPLOAD_MAX_MB} MB")
+
+def project_context(root: str, question: str, budget: int) -> tuple:
+    # Top-k chunks for `question`, best first, as a block to put in front of
+    # it; chunks that would push the block past INDEX_SHARE of the prompt
+    # budget are left out. Returns (block, ["path:start-end", ...]).
+    ix = project_index(root)
+    ix.refresh(INDEX_RESCAN)
+    room, parts, refs = int(budget * INDEX_SHARE), [], []
+    for hit in ix.search(question, INDEX_TOP_K):
+        ref  = f'{hit["path"]}:{hit["start"]}-{hit["end"]}'
+        lang = os.path.splitext(hit["path"])[1].lstrip(".")
+        part = f'── {ref}  ({hit["name"]})\n```{lang}\n{hit["text"]}\n```\n'
+        if est_tokens(part) > room:
+            continue
+        room -= est_tokens(part)
+        parts.append(part)
+        refs.append(ref)
+    if not parts:
+        return "", []
+    head = f"PROJECT CONTEXT — code from {os.path.basename(ix.root)} retrieved for this question:\n\n"
+    return head + "\n".join(parts) + "\nQUESTION:\n", refs
 
 # ═══════════════════════════════════════════════════════════════════════
 #  AUDIO
@@ -550,29 +2092,60 @@ def capture_voice():
 def init_state():
     defs = {
         "messages":      [],
-        "session_id":    hashlib.md5(str(time.time()).encode()).hexdigest()[:8].upper(),
+        "session_id":    new_session_id(),
         "query_count":   0,
         "mode":          "Normal",
         "show_thoughts": True,
         "debug_mode":    False,
         "pending_audio": None,
         "last_elapsed":  0.0,
+        "msg_base":      0,      # absolute index of messages[0]
+        "ctx_start":     0,      # absolute index of the pinned context start
+        "older":         [],     # earlier messages paged in from the store, display only
+        "older_base":    0,      # absolute index of older[0]
+        "expanded":      set(),  # absolute indices of collapsed exchanges opened in full
+        "gen_overrides": {},     # mode -> sidebar overrides of its generation profile
+        "project":       "",     # root of the attached, indexed project
+        "project_label": "",
+        "project_on":    True,   # retrieve from it in PROJECT_MODES
     }
     for k, v in defs.items():
         if k not in st.session_state:
             st.session_state[k] = v
+    if "restored" not in st.session_state:
+        # First run of this browser session: pick the conversation up from ?sid=.
+        st.session_state.restored = True
+        sid = sid_from_link(st.query_params.get("sid"))
+        if sid:
+            restore_session(sid)
+        st.query_params["sid"] = sid_link(st.session_state.session_id)
+
+def restore_session(sid: str):
+    store = conversation_store()
+    msgs, first = store.page(sid)
+    if not msgs:
+        return
+    st.session_state.session_id  = sid
+    st.session_state.messages    = msgs
+    st.session_state.msg_base    = first
+    st.session_state.ctx_start   = first
+    st.session_state.query_count = store.count(sid, "user")
 
 def clear_chat():
     st.session_state.messages    = []
     st.session_state.query_count = 0
     st.session_state.last_elapsed= 0.0
-    st.session_state.session_id  = hashlib.md5(str(time.time()).encode()).hexdigest()[:8].upper()
+    st.session_state.msg_base    = 0
+    st.session_state.ctx_start   = 0
+    st.session_state.older       = []
+    st.session_state.expanded    = set()
+    st.session_state.session_id  = new_session_id()
+    st.query_params["sid"]       = sid_link(st.session_state.session_id)
 
 # ═══════════════════════════════════════════════════════════════════════
 #  SKYLINE SVG
 # ═══════════════════════════════════════════════════════════════════════
 SKYLINE = """
-<div class="sky">
 <svg viewBox="0 0 1400 72" preserveAspectRatio="none" xmlns="http://www.w3.org/2000/svg">
   <defs>
     <linearGradient id="wg" x1="0" y1="0" x2="0" y2="1">
@@ -635,16 +2208,77 @@ SKYLINE = """
   <!-- Water reflection glow -->
   <rect x="0" y="64" width="1400" height="8" fill="url(#wg)" opacity="0.35"/>
 </svg>
-</div>
 """
 
+# ═══════════════════════════════════════════════════════════════════════
+#  THEME ASSETS
+# ═══════════════════════════════════════════════════════════════════════
+STATIC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "static")
+WEB_FONTS  = os.environ.get("CYBERBOT_WEB_FONTS", "") == "1"   # load fonts missing from static/fonts/ from Google
+FONT_FACES = (("Orbitron", "orbitron.woff2", "400 900", "Orbitron:wght@400;600;700;900"),
+              ("Share Tech Mono", "share-tech-mono.woff2", "400", "Share+Tech+Mono"),
+              ("Rajdhani", "rajdhani.woff2", "300 700", "Rajdhani:wght@300;400;500;600;700"))
+
+def minify_css(css: str) -> str:
+    css = re.sub(r'/\*.*?\*/', '', css, flags=re.S)
+    css = re.sub(r'\s+', ' ', css)
+    css = re.sub(r'\s*([{};,>])\s*', r'\1', css)
+    return re.sub(r':\s+', ':', css).replace(';}', '}').strip()
+
+def minify_svg(svg: str) -> str:
+    svg = re.sub(r'<!--.*?-->', '', svg, flags=re.S)
+    return re.sub(r'>\s+<', '><', re.sub(r'\s+', ' ', svg)).strip()
+
+def font_faces(prefix: str) -> str:
+    # Fonts bundled in static/fonts/ are served locally (installed copies
+    # first). Missing ones fall back to system fonts, or come from Google
+    # Fonts with WEB_FONTS; that @import must open the stylesheet.
+    local   = [f for f in FONT_FACES if os.path.isfile(os.path.join(STATIC_DIR, "fonts", f[1]))]
+    missing = [f[3] for f in FONT_FACES if f not in local]
+    css = (f"@import url('https://fonts.googleapis.com/css2?family={'&family='.join(missing)}&display=swap');"
+           if missing and WEB_FONTS else "")
+    return css + ''.join(f"@font-face{{font-family:'{name}';src:local('{name}'),url('{prefix}fonts/{file}') format('woff2');"
+                         f"font-weight:{weight};font-display:swap}}" for name, file, weight, _ in local)
+
+def _write_asset(stem: str, ext: str, body: str) -> str:
+    name = f"{stem}.{hashlib.sha1(body.encode()).hexdigest()[:10]}.{ext}"
+    path = os.path.join(STATIC_DIR, name)
+    if not os.path.exists(path):
+        os.makedirs(STATIC_DIR, exist_ok=True)
+        with open(path + ".tmp", "w", encoding="utf-8") as f:
+            f.write(body)
+        os.replace(path + ".tmp", path)
+    return name
+
+def build_theme(static: bool) -> tuple:
+    # (head, skyline) markup for main(). With static serving the theme is two
+    # content-hashed files the browser caches, and each rerun only carries
+    # the tags; otherwise the minified CSS and SVG are inlined.
+    css = minify_css(CSS.replace("<style>", "").replace("</style>", ""))
+    svg = minify_svg(SKYLINE)
+    if static:
+        try:
+            return (f'<link rel="stylesheet" href="app/static/{_write_asset("cyberbot", "css", font_faces("") + css)}">',
+                    f'<div class="sky"><img src="app/static/{_write_asset("skyline", "svg", svg)}" alt=""></div>')
+        except OSError:
+            pass
+    return f'<style>{font_faces("app/static/")}{css}</style>', f'<div class="sky">{svg}</div>'
+
+@st.cache_resource
+def theme_assets() -> tuple:
+    return build_theme(bool(st.get_option("server.enableStaticServing")))
+
 # ═══════════════════════════════════════════════════════════════════════
 #  UI: HEADER
 # ═══════════════════════════════════════════════════════════════════════
+@st.fragment(run_every=HEALTH_TTL, key="header")
 def render_header():
-    online = check_ollama()
+    online = ollama_monitor().online
     pill_cls = "on" if online else "off"
-    pill_txt = "● ONLINE" if online else "● OFFLINE"
+    pill_txt = "● ONLINE" if online else ("● OFFLINE" if online is False else "● PROBING")
+    warm     = model_warmer().state
+    warm_cls = {"hot": "on", "cold": "off"}.get(warm, "")
+    warm_txt = {"hot": "◆ MODEL HOT", "cold": "◇ MODEL COLD"}.get(warm, "◈ LOADING")
     now = datetime.datetime.now().strftime("%Y·%m·%d %H:%M")
     st.markdown(
         f'<div class="cb-hdr">'
@@ -652,9 +2286,10 @@ def render_header():
         f'<span class="cpill">{APP_VER}</span>'
         f'<span class="cpill">{now}</span>'
         f'<span class="cpill {pill_cls}">{pill_txt}</span>'
+        f'<span class="cpill {warm_cls}">{warm_txt}</span>'
         f'</div>'
         f'<div class="cb-name">CyberBot</div>'
-        f'<div class="cb-sub">NEURAL CODE INTERFACE &nbsp;·&nbsp; CODEGEMMA-2B &nbsp;·&nbsp; MODE: {st.session_state.mode.upper()} &nbsp;·&nbsp; SID:{st.session_state.session_id}</div>'
+        f'<div class="cb-sub">NEURAL CODE INTERFACE &nbsp;·&nbsp; CODEGEMMA-2B &nbsp;·&nbsp; MODE: {st.session_state.mode.upper()} &nbsp;·&nbsp; SID:{st.session_state.session_id[:8]}</div>'
         f'</div>',
         unsafe_allow_html=True,
     )
@@ -663,54 +2298,12 @@ def render_header():
 #  UI: SIDEBAR
 # ═══════════════════════════════════════════════════════════════════════
 def render_sidebar():
+    # Each panel is a fragment keyed by what it shows, so a widget only reruns
+    # the parts that depend on it (see the on_change callbacks below).
     with st.sidebar:
-        # Status
-        online = check_ollama()
-        d_cls  = "don" if online else "doff"
-        d_col  = "#39FF14" if online else "#FF3D00"
-        d_txt  = "OLLAMA  ONLINE" if online else "OLLAMA  OFFLINE"
-        st.markdown(
-            f'<div class="sb"><span class="sbh">◈ System Status</span>'
-            f'<p style="font-family:Share Tech Mono,monospace;font-size:0.73rem;">'
-            f'<span class="dot {d_cls}"></span><span style="color:{d_col};">{d_txt}</span></p>'
-            f'<p style="font-family:Share Tech Mono,monospace;font-size:0.61rem;color:rgba(0,232,255,0.52);margin-top:2px;">⬡ CODEGEMMA-2B-Q4_K_M</p>'
-            + ('' if online else
-               '<p style="font-family:Share Tech Mono,monospace;font-size:0.57rem;'
-               'color:rgba(255,61,0,0.60);margin-top:3px;">Run: ollama serve</p>')
-            + '</div>',
-            unsafe_allow_html=True,
-        )
-
-        # Metrics
-        cnt = len(st.session_state.messages)
-        pct = min(100, int(cnt / MAX_HISTORY * 100))
-        st.markdown(
-            f'<div class="sb"><span class="sbh">◈ Session Metrics</span>'
-            f'<div class="mrow">'
-            f'<div class="mcard"><div class="mval">{st.session_state.query_count}</div><div class="mlbl">Queries</div></div>'
-            f'<div class="mcard"><div class="mval">{cnt}</div><div class="mlbl">Msgs</div></div>'
-            f'<div class="mcard"><div class="mval">{pct}%</div><div class="mlbl">Mem</div></div>'
-            f'</div>'
-            f'<div class="memb"><div class="memf" style="width:{pct}%;"></div></div>'
-            + (f'<p style="font-family:Share Tech Mono,monospace;font-size:0.60rem;color:rgba(255,215,0,0.60);margin-top:5px;">⏱ Last: {st.session_state.last_elapsed}s</p>' if st.session_state.last_elapsed > 0 else '')
-            + '</div>',
-            unsafe_allow_html=True,
-        )
-
-        # Mode
-        modes = ["Normal", "Deep Thought", "Code Master", "Debug"]
-        st.markdown('<div class="sb"><span class="sbh">◈ Operation Mode</span>', unsafe_allow_html=True)
-        mode = st.radio("Mode", modes, index=modes.index(st.session_state.mode), label_visibility="collapsed")
-        st.session_state.mode = mode
-        bcls = {"Normal":"bn","Deep Thought":"bd","Code Master":"bc","Debug":"bdb"}
-        blbl = {"Normal":"STANDARD","Deep Thought":"DEEP THOUGHT","Code Master":"CODE MASTER","Debug":"DEBUG MODE"}
-        st.markdown(f'<span class="badge {bcls[mode]}">{blbl[mode]}</span></div>', unsafe_allow_html=True)
-
-        # Settings
-        st.markdown('<div class="sb"><span class="sbh">◈ Display</span>', unsafe_allow_html=True)
-        st.session_state.show_thoughts = st.toggle("Thought Process", value=st.session_state.show_thoughts)
-        st.session_state.debug_mode    = st.toggle("Debug Info Panel",  value=st.session_state.debug_mode)
-        st.markdown('</div>', unsafe_allow_html=True)
+        sidebar_status()
+        sidebar_controls()
+        sidebar_project()
 
         # Actions
         st.markdown('<div class="sb"><span class="sbh">◈ Actions</span>', unsafe_allow_html=True)
@@ -737,6 +2330,182 @@ def render_sidebar():
             unsafe_allow_html=True,
         )
 
+@st.fragment(run_every=HEALTH_TTL, key="status")
+def sidebar_status():
+    mon    = ollama_monitor()
+    online = mon.online
+    d_cls  = "don" if online else "doff"
+    d_col  = "#39FF14" if online else "#FF3D00"
+    d_txt  = "OLLAMA  ONLINE" if online else ("OLLAMA  OFFLINE" if online is False else "OLLAMA  PROBING")
+    warmer   = model_warmer()
+    warm_lbl = {"hot": "RESIDENT", "cold": "NOT LOADED"}.get(warmer.state, "LOADING…")
+    if warmer.state == "hot" and warmer.loaded_s:
+        warm_lbl += f" ({warmer.loaded_s}s load)"
+    hint   = ""
+    if online is False:
+        hint = "Run: ollama serve"
+    elif online and any(m not in mon.models for m in ROUTE_MODELS):
+        hint = "Run: ollama pull " + next(m for m in ROUTE_MODELS if m not in mon.models)
+    st.markdown(
+        f'<div class="sb"><span class="sbh">◈ System Status</span>'
+        f'<p style="font-family:Share Tech Mono,monospace;font-size:0.73rem;">'
+        f'<span class="dot {d_cls}"></span><span style="color:{d_col};">{d_txt}</span></p>'
+        f'<p style="font-family:Share Tech Mono,monospace;font-size:0.61rem;color:rgba(0,232,255,0.52);margin-top:2px;">⬡ {_esc(" + ".join(m.rsplit("/", 1)[-1].upper() for m in ROUTE_MODELS))}'
+        f' &nbsp;·&nbsp; {warm_lbl}</p>'
+        + (f'<p style="font-family:Share Tech Mono,monospace;font-size:0.57rem;color:rgba(0,232,255,0.40);margin-top:2px;">'
+           f'⇄ {mon.latency}ms &nbsp;·&nbsp; {len(mon.loaded)} loaded &nbsp;·&nbsp; {len(mon.models)} installed</p>' if online else '')
+        + (f'<p style="font-family:Share Tech Mono,monospace;font-size:0.57rem;'
+           f'color:rgba(255,61,0,0.60);margin-top:3px;word-break:break-all;">{_esc(hint)}</p>' if hint else '')
+        + '</div>',
+        unsafe_allow_html=True,
+    )
+
+    # Debug counters (process-wide, so they ride on the status refresh)
+    if st.session_state.debug_mode:
+        rc, sem = response_cache(), semantic_cache()
+        lines = [f'⟳ answer cache: {rc.hits} hit / {rc.misses} miss &nbsp;·&nbsp; {len(rc)} stored ({rc.size / 1e6:.1f} MB)']
+        if sem:
+            lines.append(f'≈ semantic cache: {sem.index.hits} hit / {sem.index.misses} miss &nbsp;·&nbsp; {sem.index.n} vectors')
+        lines.append(f'▦ render cache: {render_cache().hits} hit / {render_cache().misses} miss')
+        sch = scheduler()
+        lines.append(f'⇶ scheduler: {sch.limit - sch.running}/{sch.limit} free · {sch.waiting} queued &nbsp;·&nbsp; '
+                     f'{sch.served} served / {sch.cancelled} cancelled / {sch.timeouts} timed out')
+        upto, _ = conversation_store().summary(st.session_state.session_id)
+        lines.append(f'≡ summaries: {compactor().runs} built / {compactor().failed} failed'
+                     + (f' &nbsp;·&nbsp; this chat: first {upto} msgs summarized' if upto else ''))
+        for b in sch.pool.backends:
+            lines.append(f'⛁ {_esc(b.host)}: {b.inflight} in flight &nbsp;·&nbsp; {b.served} served / {b.failed} failed'
+                         f' &nbsp;·&nbsp; ttft p50 {b.p50():.2f}s' + ('' if sch.pool.healthy(b) else ' &nbsp;·&nbsp; DOWN'))
+        for route, model, share, p50, p95 in router().summary():
+            lat = f'p50 {p50:.1f}s / p95 {p95:.1f}s' if p50 is not None else 'no requests'
+            lines.append(f'⇄ {route} ({_esc(model.rsplit("/", 1)[-1])}): {share:.0%} of traffic &nbsp;·&nbsp; {lat}')
+        st.markdown(
+            f'<div class="sb"><span class="sbh">◈ Debug</span>'
+            f'<p style="font-family:Share Tech Mono,monospace;font-size:0.58rem;color:rgba(255,215,0,0.60);line-height:1.8;">'
+            f'{"<br>".join(lines)}</p></div>',
+            unsafe_allow_html=True,
+        )
+
+def _set_mode():
+    st.session_state.mode = st.session_state.sb_mode
+    st.rerun(["header", "controls", "input"])
+
+def streaming() -> bool:
+    # True in the run that will stream an answer (main pops pending_send after
+    # the sidebar). Keyed st.rerun([...]) callbacks preempt a running script,
+    # so their widgets are disabled until the answer is in; only ■ STOP may
+    # cut it short.
+    return "pending_send" in st.session_state
+
+@st.fragment(key="project")
+def sidebar_project():
+    # Attach a local folder or an uploaded archive; Debug and Code Master then
+    # get the most relevant chunks of it with every question.
+    st.markdown('<div class="sb"><span class="sbh">◈ Project Context</span>', unsafe_allow_html=True)
+    path = ""
+    if PROJECT_ROOT:
+        path = st.text_input("Project folder", key="proj_path", placeholder=f"folder under {PROJECT_ROOT}",
+                             label_visibility="collapsed")
+    up   = st.file_uploader("Project archive", type=["zip", "tar", "gz", "tgz"], key="proj_zip")
+    if st.button("⟳ INDEX", key="proj_index"):
+        root, bad = None, ""
+        try:
+            root = unpack_archive(up.name, up.getvalue()) if up else project_path(path.strip())
+        except (tarfile.TarError, zipfile.BadZipFile, ValueError, OSError, EOFError) as exc:
+            bad = f"⚠ Could not unpack {up.name}: {exc}"    # corrupt, not an archive, or over the limits
+        if bad:
+            st.warning(bad)
+        elif not root:
+            st.warning(f"⚠ Enter a folder under {PROJECT_ROOT} or upload a .zip / .tar.gz." if PROJECT_ROOT
+                       else "⚠ Upload a .zip / .tar.gz of the project.")
+        else:
+            bar = st.progress(0.0, text="scanning…")
+            res = project_index(root).update(progress=lambda i, n: bar.progress(i / n, text=f"indexed {i:,}/{n:,} files"))
+            bar.empty()
+            st.session_state.project, st.session_state.project_label = root, (up.name if up else root)
+            st.caption(f"{res['changed']:,} files (re)indexed, {res['removed']:,} removed in {res['seconds']}s")
+    if st.session_state.project:
+        ix = project_index(st.session_state.project)
+        st.markdown(
+            f'<p style="font-family:Share Tech Mono,monospace;font-size:0.58rem;color:rgba(0,232,255,0.55);'
+            f'word-break:break-all;">⌕ {_esc(st.session_state.project_label)}<br>'
+            f'{ix.files:,} files · {ix.n:,} chunks · {ix.lines:,} lines</p>',
+            unsafe_allow_html=True,
+        )
+        st.toggle("Use in Debug / Code Master", key="project_on")
+        if st.button("✕ Detach", key="proj_detach"):
+            st.session_state.project = st.session_state.project_label = ""
+            st.rerun(scope="fragment")
+    st.markdown('</div>', unsafe_allow_html=True)
+
+def _set_profile(mode: str, field: str):
+    value = st.session_state[f"gp_{field}_{mode}"]
+    if field == "stop":
+        value = [s.strip() for s in value.split(",") if s.strip()]
+    st.session_state.gen_overrides.setdefault(mode, {})[field] = value
+
+def _reset_profile(mode: str):
+    st.session_state.gen_overrides.pop(mode, None)
+    for field in ("temperature", "num_predict", "adaptive", "stop"):
+        st.session_state.pop(f"gp_{field}_{mode}", None)
+
+def session_options() -> dict:
+    return gen_options(st.session_state.mode, st.session_state.gen_overrides.get(st.session_state.mode))
+
+@st.fragment(key="controls")
+def sidebar_controls():
+    # Metrics
+    cnt = st.session_state.msg_base + len(st.session_state.messages)
+    bud = prompt_budget(session_options()["num_predict"])
+    upto, summary = conversation_store().summary(st.session_state.session_id)
+    ctx = msgs_tokens(build_msgs(st.session_state.messages, "", st.session_state.mode, bud,
+                                 max(0, max(st.session_state.ctx_start, upto) - st.session_state.msg_base), summary))
+    pct = min(100, int(ctx / bud * 100))
+    st.markdown(
+        f'<div class="sb"><span class="sbh">◈ Session Metrics</span>'
+        f'<div class="mrow">'
+        f'<div class="mcard"><div class="mval">{st.session_state.query_count}</div><div class="mlbl">Queries</div></div>'
+        f'<div class="mcard"><div class="mval">{cnt}</div><div class="mlbl">Msgs</div></div>'
+        f'<div class="mcard"><div class="mval">{pct}%</div><div class="mlbl">Mem</div></div>'
+        f'</div>'
+        f'<div class="memb"><div class="memf" style="width:{pct}%;"></div></div>'
+        f'<p style="font-family:Share Tech Mono,monospace;font-size:0.55rem;color:rgba(0,232,255,0.40);">◈ ctx ≈ {ctx:,} / {bud:,} tokens</p>'
+        + (f'<p style="font-family:Share Tech Mono,monospace;font-size:0.60rem;color:rgba(255,215,0,0.60);margin-top:5px;">⏱ Last: {st.session_state.last_elapsed}s</p>' if st.session_state.last_elapsed > 0 else '')
+        + '</div>',
+        unsafe_allow_html=True,
+    )
+
+    # Mode
+    modes = ["Normal", "Deep Thought", "Code Master", "Debug"]
+    st.markdown('<div class="sb"><span class="sbh">◈ Operation Mode</span>', unsafe_allow_html=True)
+    mode = st.radio("Mode", modes, index=modes.index(st.session_state.mode), key="sb_mode",
+                    on_change=_set_mode, label_visibility="collapsed", disabled=streaming())
+    bcls = {"Normal":"bn","Deep Thought":"bd","Code Master":"bc","Debug":"bdb"}
+    blbl = {"Normal":"STANDARD","Deep Thought":"DEEP THOUGHT","Code Master":"CODE MASTER","Debug":"DEBUG MODE"}
+    st.markdown(f'<span class="badge {bcls[mode]}">{blbl[mode]}</span></div>', unsafe_allow_html=True)
+
+    # Generation profile of the selected mode; widgets are keyed per mode
+    prof = {**GEN_PROFILES[mode], **st.session_state.gen_overrides.get(mode, {})}
+    with st.expander("⚙ Generation Profile"):
+        st.slider("Temperature", 0.0, 1.5, float(prof["temperature"]), 0.05, key=f"gp_temperature_{mode}",
+                  on_change=_set_profile, args=(mode, "temperature"))
+        st.number_input("Max reply tokens", 128, NUM_CTX - 1024, int(prof["num_predict"]), 128,
+                        key=f"gp_num_predict_{mode}", on_change=_set_profile, args=(mode, "num_predict"))
+        st.toggle("Adaptive reply length", prof.get("adaptive", True), key=f"gp_adaptive_{mode}",
+                  on_change=_set_profile, args=(mode, "adaptive"),
+                  help="Learn the limit from recent answer lengths in this mode, up to the max above")
+        st.text_input("Stop sequences", ", ".join(prof["stop"]), key=f"gp_stop_{mode}",
+                      on_change=_set_profile, args=(mode, "stop"), help="Comma-separated")
+        st.button("↺ Profile defaults", key=f"gp_reset_{mode}", on_click=_reset_profile, args=(mode,))
+        st.caption(f"Next reply: up to {session_options()['num_predict']:,} tokens")
+
+    # Settings: both only change how answers are drawn
+    st.markdown('<div class="sb"><span class="sbh">◈ Display</span>', unsafe_allow_html=True)
+    st.toggle("Thought Process", key="show_thoughts", on_change=st.rerun, args=(["chat"],), disabled=streaming())
+    st.toggle("Debug Info Panel", key="debug_mode", on_change=st.rerun, args=(["chat", "status"],),
+              disabled=streaming())
+    st.markdown('</div>', unsafe_allow_html=True)
+
 # ═══════════════════════════════════════════════════════════════════════
 #  UI: RENDER ONE MESSAGE
 # ═══════════════════════════════════════════════════════════════════════
@@ -749,36 +2518,17 @@ def render_message(role: str, content: str, ts: str = "", meta: dict = None):
             unsafe_allow_html=True,
         )
     else:
-        main_text, thought_html = split_thoughts(content)
-        formatted = format_ai_text(main_text)
-
-        t_sec = ""
-        if thought_html and st.session_state.get("show_thoughts", True):
-            t_sec = thought_html
-
-        d_sec = ""
-        if st.session_state.get("debug_mode", False) and meta:
-            d_sec = (
-                f'<div class="dinfo">'
-                f'⏱ {meta.get("elapsed","?")}s elapsed &nbsp;|&nbsp; '
-                f'✎ {meta.get("chars",0)} chars &nbsp;|&nbsp; '
-                f'◈ {meta.get("mode","?")} mode &nbsp;|&nbsp; '
-                f'⬡ codegemma-2b-q4_k_m'
-                f'</div>'
-            )
-
         st.markdown(
-            f'<div class="mwrap"><div class="mai"><span class="lai">⚡ CYBERBOT</span>'
-            f'{t_sec}'
-            f'<div class="mbody">{formatted}</div>'
-            f'{d_sec}'
-            f'<div class="mts">{ts}</div></div></div>',
+            render_ai_html(content, ts, meta,
+                           st.session_state.get("show_thoughts", True),
+                           st.session_state.get("debug_mode", False)),
             unsafe_allow_html=True,
         )
 
 # ═══════════════════════════════════════════════════════════════════════
 #  UI: RENDER CHAT HISTORY
 # ═══════════════════════════════════════════════════════════════════════
+@st.fragment(key="chat")
 def render_chat():
     if not st.session_state.messages:
         st.markdown(
@@ -797,19 +2547,51 @@ def render_chat():
             unsafe_allow_html=True,
         )
         return
-    for msg in st.session_state.messages:
+    # Only the last RENDER_RECENT exchanges go out as full cards; older turns
+    # are a summary line each, so the page stays bounded however long the
+    # conversation gets.
+    older = st.session_state.older
+    shown = older + st.session_state.messages
+    base  = st.session_state.older_base if older else st.session_state.msg_base
+    cut   = max(0, len(shown) - RENDER_RECENT * 2)
+    if base > 0:
+        st.button(f"⇡ LOAD OLDER  ({base} on disk)", key="btn_older", on_click=load_older, args=(base,))
+    i = 0
+    while i < cut:
+        pair = 2 if shown[i]["role"] == "user" and i + 1 < len(shown) and shown[i + 1]["role"] == "assistant" else 1
+        seq  = base + i
+        if seq in st.session_state.expanded:
+            for msg in shown[i:i + pair]:
+                render_message(msg["role"], msg["content"], msg.get("ts",""), msg.get("meta"))
+        else:
+            c1, c2 = st.columns([14, 1])
+            c1.markdown(summary_html(shown[i:i + pair]), unsafe_allow_html=True)
+            c2.button("▸", key=f"exp_{seq}", on_click=st.session_state.expanded.add, args=(seq,), help="Expand")
+        i += pair
+    for msg in shown[max(i, cut):]:
         render_message(msg["role"], msg["content"], msg.get("ts",""), msg.get("meta"))
 
+def summary_html(turn: list) -> str:
+    q    = turn[0]["content"].strip().split("\n", 1)[0]
+    ai   = turn[-1] if turn[-1]["role"] == "assistant" else None
+    info = [f'{len(ai["content"]) / 1024:.1f} KB' if ai else "no reply"]
+    if ai and ai.get("meta"):
+        info.insert(0, ai["meta"].get("mode", ""))
+    info.append(turn[0].get("ts", ""))
+    return (f'<div class="msum"><span class="msq">{"⬡" if turn[0]["role"] == "user" else "⚡"} {_esc(q[:120])}</span>'
+            f'<span class="msm">{_esc(" · ".join(x for x in info if x))}</span></div>')
+
+def load_older(first: int):
+    msgs, start = conversation_store().page(st.session_state.session_id, before=first, limit=OLDER_PAGE)
+    st.session_state.older      = msgs + st.session_state.older
+    st.session_state.older_base = start
+
 # ═══════════════════════════════════════════════════════════════════════
 #  CORE: HANDLE SEND
 # ═══════════════════════════════════════════════════════════════════════
 def handle_send(user_text: str):
     user_text = user_text.strip()
-    if not user_text:
-        st.warning("⚠ Input is empty — type a question or paste code.")
-        return
-
-    if not check_ollama():
+    if not ollama_monitor().wait(PROBE_TIMEOUT):
         st.error(
             "🔴 **CyberBot Offline** — Ollama is not running.\n\n"
             "**Start it:** `ollama serve`\n\n"
@@ -820,62 +2602,135 @@ def handle_send(user_text: str):
 
     ts = datetime.datetime.now().strftime("%H:%M:%S")
     st.session_state.messages.append({"role":"user","content":user_text,"ts":ts})
+    conversation_store().append(st.session_state.session_id, st.session_state.messages[-1])
     st.session_state.query_count += 1
     render_message("user", user_text, ts)
 
     history = st.session_state.messages[:-1]
-    msgs    = build_msgs(history, user_text, st.session_state.mode)
+    base    = st.session_state.msg_base
+    opts    = session_options()
+    budget  = prompt_budget(opts["num_predict"])
+    upto, summary = conversation_store().summary(st.session_state.session_id)
+    ask, refs = user_text, []
+    if st.session_state.project and st.session_state.project_on and st.session_state.mode in PROJECT_MODES:
+        # Retrieved code goes with this question only; history keeps the question alone.
+        block, refs = project_context(st.session_state.project, user_text, budget)
+        ask = block + user_text
+    # Debug input too long for one prompt: analysed in parts, then merged (map_reduce).
+    mapped  = st.session_state.mode == "Debug" and est_tokens(user_text) > MAP_TRIGGER
+    if mapped:
+        ask, refs = input_question(user_text), []
+    start   = max(st.session_state.ctx_start, upto)          # summarized turns are not resent
+    room    = budget - int(budget * MAP_REDUCE_SHARE) if mapped else budget
+    first   = fit_start(history, ask, st.session_state.mode, start - base, room, summary)
+    st.session_state.ctx_start = base + first
+    msgs    = build_msgs(history, ask, st.session_state.mode, budget, first, summary)
+    stats   = {"route": router().pick(st.session_state.mode, user_text)}
+    if summary:
+        stats["summarized"] = upto
+    if refs:
+        stats["retrieved"] = refs
 
     ph         = st.empty()
-    full_text  = ""
+    # Clicking STOP interrupts this script run; the finally below keeps the
+    # partial answer and closing the generator aborts the Ollama request.
+    stop_box   = st.empty()
+    stop_box.button("■ STOP", key="btn_stop")
+    live       = StreamRenderer()
     char_acc   = 0
     start      = time.time()
+    ttft       = None
+
+    def on_wait(pos):
+        ph.markdown(
+            f'<div class="sbox"><span class="slbl">⚡ CYBERBOT  —  QUEUED #{pos} ({round(time.time() - start, 1)}s)</span>'
+            f'<div class="stxt"><span class="cur"></span></div></div>',
+            unsafe_allow_html=True,
+        )
+
+    def on_map(parts):
+        done = sum(p["status"] == "done" for p in parts)
+        icon = {"queued": "◇", "running": "◈", "done": "◆", "error": "✕"}
+        rows = "<br>".join(f'{icon[p["status"]]} lines {p["lines"][0]}–{p["lines"][1]} &nbsp;·&nbsp; '
+                           + (f'{p["tokens"]} tokens' if p["status"] != "queued" else "queued") for p in parts)
+        ph.markdown(
+            f'<div class="sbox"><span class="slbl">⚡ CYBERBOT  —  MAP {done}/{len(parts)} PARTS '
+            f'({round(time.time() - start, 1)}s)</span><div class="stxt">{rows}</div></div>',
+            unsafe_allow_html=True,
+        )
+
+    def reduce(merged: str):
+        msgs[:] = build_msgs(history, merged, st.session_state.mode, budget, first, summary)
+        return generate(msgs, st.session_state.mode, stats, st.session_state.session_id, on_wait, opts,
+                        ROUTES[stats["route"]])
 
+    if mapped:
+        gen = map_reduce(user_text, stats, st.session_state.session_id, ROUTES["fast"], on_map, reduce)
+    else:
+        gen = generate(msgs, st.session_state.mode, stats, st.session_state.session_id, on_wait, opts,
+                       ROUTES[stats["route"]])
+    full_text = None
     try:
-        for tok in stream_response(msgs):
-            full_text += tok
+        for tok in gen:
+            if ttft is None:
+                ttft = time.time() - start
+            live.feed(tok)
             char_acc  += len(tok)
-            if char_acc % 60 < len(tok) or len(full_text) < 80:
+            if char_acc % 60 < len(tok) or char_acc < 80:
                 elapsed = round(time.time() - start, 1)
                 ph.markdown(
                     f'<div class="sbox"><span class="slbl">⚡ CYBERBOT  —  THINKING... ({elapsed}s)</span>'
-                    f'<div class="stxt">{_esc(full_text)}<span class="cur"></span></div></div>',
+                    f'<div class="stxt">{live.html()}<span class="cur"></span></div></div>',
                     unsafe_allow_html=True,
                 )
+        full_text = live.text
     except Exception as exc:
-        full_text += f"\n\n**[ERROR]:** Could not reach Ollama model.\n\nDetails: {exc}"
+        ollama_monitor().invalidate()
+        full_text = live.text + f"\n\n**[ERROR]:** Could not reach Ollama model.\n\nDetails: {exc}"
+    finally:
+        gen.close()
+        if full_text is None:
+            # STOP, another widget or a closed tab cut the run short. Only
+            # session state is safe to touch here; the next run redraws.
+            full_text = live.text
+            stats["done_reason"] = "stopped"
+        save_answer(msgs, stats, start, ttft, full_text)
 
     ph.empty()
+    stop_box.empty()
+    st.rerun()
+
+def save_answer(msgs: list, stats: dict, start: float, ttft: float, full_text: str):
+    if stats.get("eval_count") is not None:
+        model_warmer().mark_used()
     elapsed_f = round(time.time() - start, 2)
+    meta = gen_meta(st.session_state.mode, msgs, stats, elapsed_f, ttft, len(full_text))
+    metrics().record(meta)
+    reply_budget().observe(st.session_state.mode, stats)
+    router().record(meta)
     final_ts  = f"{datetime.datetime.now().strftime('%H:%M:%S')}  [{elapsed_f}s]"
-    meta = {"elapsed": elapsed_f, "chars": len(full_text), "mode": st.session_state.mode}
+    if "truncated" in meta:
+        final_ts += f"  ✂ {meta['truncated'].upper()}"
 
     st.session_state.messages.append({"role":"assistant","content":full_text,"ts":final_ts,"meta":meta})
+    end = conversation_store().append(st.session_state.session_id, st.session_state.messages[-1]) + 1
     st.session_state.last_elapsed = elapsed_f
+    compactor().maybe_compact(st.session_state.session_id, end)
 
     if len(st.session_state.messages) > MAX_HISTORY * 2:
-        st.session_state.messages = st.session_state.messages[-(MAX_HISTORY * 2):]
-
-    st.rerun()
+        # Everything is on disk already; the window just moves its cursor.
+        drop = len(st.session_state.messages) - MAX_HISTORY * 2
+        del st.session_state.messages[:drop]
+        st.session_state.msg_base += drop
+        st.session_state.older     = []  # would leave a gap before the window; page in again
 
 # ═══════════════════════════════════════════════════════════════════════
-#  MAIN
+#  UI: INPUT TERMINAL
 # ═══════════════════════════════════════════════════════════════════════
-def main():
-    st.set_page_config(
-        page_title="CyberBot — Neural Interface",
-        page_icon="🌆", layout="wide",
-        initial_sidebar_state="expanded",
-    )
-    st.markdown(CSS, unsafe_allow_html=True)
-    init_state()
-    render_sidebar()
-    render_header()
-    render_chat()
-    st.markdown(SKYLINE, unsafe_allow_html=True)
-    st.markdown('<div class="ndiv"></div>', unsafe_allow_html=True)
-
-    # Input toolbar label
+@st.fragment(key="input")
+def render_input():
+    # Typing, VOICE and validation messages rerun only this fragment; a
+    # TRANSMIT or CLEAR changes the conversation and reruns the whole app.
     badge_cls = {"Normal":"bn","Deep Thought":"bd","Code Master":"bc","Debug":"bdb"}
     st.markdown(
         f'<div class="itopbar"><span class="ilbl">◈ INPUT TERMINAL</span>'
@@ -920,14 +2775,45 @@ def main():
             if result and not result.startswith("["):
                 st.success(f"✓ Heard: \"{result}\"")
                 st.session_state.pending_audio = result
-                st.rerun()
+                st.rerun(scope="fragment")
             elif result:
                 st.error(f"Audio error: {result}")
             else:
                 st.warning("No speech detected — please try again.")
 
     if send:
-        handle_send(user_input)
+        if not user_input.strip():
+            st.warning("⚠ Input is empty — type a question or paste code.")
+        else:
+            # Streamed from the main script body (main): a fragment run cannot be
+            # interrupted, so ■ STOP clicked during it would wait for the answer.
+            st.session_state.pending_send = user_input
+            st.rerun()
+
+# ═══════════════════════════════════════════════════════════════════════
+#  MAIN
+# ═══════════════════════════════════════════════════════════════════════
+def main():
+    st.set_page_config(
+        page_title="CyberBot — Neural Interface",
+        page_icon="🌆", layout="wide",
+        initial_sidebar_state="expanded",
+    )
+    head, skyline = theme_assets()
+    st.markdown(head, unsafe_allow_html=True)
+    init_state()
+    model_warmer().touch()
+    if METRICS_PORT:
+        metrics_server(METRICS_HOST, METRICS_PORT)
+    render_sidebar()
+    render_header()
+    render_chat()
+    st.markdown(skyline, unsafe_allow_html=True)
+    st.markdown('<div class="ndiv"></div>', unsafe_allow_html=True)
+
+    render_input()
+    if "pending_send" in st.session_state:
+        handle_send(st.session_state.pop("pending_send"))
 
     st.markdown(
         '<div class="fglow"></div>'
@@ -936,5 +2822,239 @@ def main():
         unsafe_allow_html=True,
     )
 
+# ═══════════════════════════════════════════════════════════════════════
+#  HEADLESS API  (python cyberbot.py --serve)
+# ═══════════════════════════════════════════════════════════════════════
+API_SESSIONS = 1000           # server-side conversations kept, LRU beyond this
+API_MAX_BODY = 4 * 1024 * 1024   # largest request body read, bytes
+
+class ApiServer:
+    # Minimal HTTP/1.1 + SSE front end on the scheduler's event loop, so API
+    # clients and Streamlit sessions share the same admission control.
+    #   GET    /v1/health
+    #   POST   /v1/chat            {"message", "mode"?, "session"?}  -> text/event-stream
+    #   DELETE /v1/sessions/<id>
+    def __init__(self, sched: Scheduler):
+        self.sched    = sched
+        self.warmer   = model_warmer()
+        self.sessions = OrderedDict()           # id -> {"messages", "base", "ctx_start", "used"}
+
+    def _session(self, sid: str = None) -> tuple:
+        # (id, state) of a session this server minted; None for an id it does
+        # not know, so clients cannot pick or guess ids (see new_session_id).
+        now = time.time()
+        for old in [k for k, s in self.sessions.items() if now - s["used"] > SESSION_IDLE]:
+            del self.sessions[old]
+        if sid and sid not in self.sessions:
+            return None
+        if not sid:
+            sid = new_session_id()
+            self.sessions[sid] = {"messages": [], "base": 0, "ctx_start": 0, "used": now}
+            while len(self.sessions) > API_SESSIONS:
+                self.sessions.popitem(last=False)
+        self.sessions.move_to_end(sid)
+        self.sessions[sid]["used"] = now
+        return sid, self.sessions[sid]
+
+    @staticmethod
+    def _send(writer, status: str, body: dict):
+        data = json.dumps(body).encode()
+        writer.write(f"HTTP/1.1 {status}\r\nContent-Type: application/json\r\n"
+                     f"Content-Length: {len(data)}\r\nConnection: close\r\n\r\n".encode() + data)
+
+    @staticmethod
+    def _event(writer, data: dict, event: str = None):
+        writer.write(((f"event: {event}\n" if event else "") + f"data: {json.dumps(data)}\n\n").encode())
+
+    async def handle(self, reader, writer):
+        try:
+            head = (await reader.readuntil(b"\r\n\r\n")).decode("latin-1").split("\r\n")
+            method, path, _ = head[0].split(" ", 2)
+            headers = {k.strip().lower(): v.strip() for k, v in (h.split(":", 1) for h in head[1:] if ":" in h)}
+            size    = int(headers.get("content-length", 0))
+            if size > API_MAX_BODY:
+                self._send(writer, "413 Content Too Large", {"error": f"body over {API_MAX_BODY} bytes"})
+                return await writer.drain()
+            raw     = await reader.readexactly(size)
+            if method == "GET" and path == "/metrics":
+                body = metrics().snapshot().encode()
+                writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: text/plain; version=0.0.4\r\n"
+                             b"Content-Length: %d\r\nConnection: close\r\n\r\n%s" % (len(body), body))
+            elif method == "GET" and path == "/v1/health":
+                mon = ollama_monitor()
+                self._send(writer, "200 OK", {"online": mon.online, "routes": ROUTES,
+                                              "loaded": [m for m in ROUTE_MODELS if m in mon.loaded],
+                                              "backends": [{"host": b.host, "up": self.sched.pool.healthy(b),
+                                                            "inflight": b.inflight} for b in self.sched.pool.backends],
+                                              "running": self.sched.running, "queued": self.sched.waiting,
+                                              "sessions": len(self.sessions)})
+            elif method == "DELETE" and path.startswith("/v1/sessions/"):
+                found = self.sessions.pop(path.rsplit("/", 1)[1], None) is not None
+                self._send(writer, "200 OK" if found else "404 Not Found", {"deleted": found})
+            elif method == "POST" and path == "/v1/chat":
+                req = json.loads(raw or b"{}")
+                if not isinstance(req, dict):
+                    raise ValueError("body must be a JSON object")
+                await self.chat(writer, req)
+            else:
+                self._send(writer, "404 Not Found", {"error": f"no route for {method} {path}"})
+            await writer.drain()
+        except (ValueError, asyncio.IncompleteReadError, asyncio.LimitOverrunError) as exc:
+            self._send(writer, "400 Bad Request", {"error": str(exc)})
+        except (ConnectionError, ClientGone):
+            self.sched.cancelled += 1
+        finally:
+            writer.close()
+
+    async def chat(self, writer, req: dict):
+        text = req.get("message", "")
+        mode = req.get("mode", "Normal")
+        if not (isinstance(text, str) and text.strip() and isinstance(mode, str) and mode in MODE_PROMPTS):
+            return self._send(writer, "400 Bad Request", {"error": "need a non-empty message and a known mode",
+                                                          "modes": list(MODE_PROMPTS)})
+        if not isinstance(req.get("session", ""), str):
+            return self._send(writer, "400 Bad Request", {"error": "session must be a string"})
+        found = self._session(req.get("session"))
+        if found is None:
+            return self._send(writer, "404 Not Found", {"error": "unknown session; omit it to start a new one"})
+        text, (sid, sess) = text.strip(), found
+        history   = sess["messages"]
+        opts      = gen_options(mode)
+        budget    = prompt_budget(opts["num_predict"])
+        first     = fit_start(history, text, mode, sess["ctx_start"] - sess["base"], budget)
+        sess["ctx_start"] = sess["base"] + first
+        msgs      = build_msgs(history, text, mode, budget, first)
+        writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\nCache-Control: no-cache\r\n"
+                     b"Connection: close\r\n\r\n")
+        self._event(writer, {"session": sid}, "session")
+        self.warmer.touch()
+
+        def on_wait(pos):
+            if writer.is_closing():
+                raise ClientGone()
+            self._event(writer, {"position": pos}, "queued")
+
+        stats, parts, start, ttft = {"route": router().pick(mode, text)}, [], time.time(), None
+        gen = self.sched.stream(sid, msgs, stats, on_wait, opts, ROUTES[stats["route"]])
+        try:
+            async for tok in gen:
+                if ttft is None:
+                    ttft = time.time() - start
+                parts.append(tok)
+                self._event(writer, {"token": tok})
+                await writer.drain()        # raises once the client hangs up, which cancels generation
+        except (ConnectionError, ClientGone):
+            raise
+        except Exception as exc:
+            ollama_monitor().invalidate()
+            return self._event(writer, {"error": str(exc)}, "error")
+        finally:
+            await gen.aclose()
+        answer = ''.join(parts)
+        history += [{"role": "user", "content": text}, {"role": "assistant", "content": answer}]
+        if len(history) > MAX_HISTORY * 2:
+            drop = len(history) - MAX_HISTORY * 2
+            del history[:drop]
+            sess["base"] += drop
+        meta = gen_meta(mode, msgs, stats, round(time.time() - start, 2), ttft, len(answer))
+        metrics().record(meta)
+        reply_budget().observe(mode, stats)
+        router().record(meta)
+        self._event(writer, {"session": sid, **meta, "done_reason": stats.get("done_reason")}, "done")
+
+def serve(host: str, port: int):
+    sched  = scheduler()
+    api    = ApiServer(sched)
+    server = asyncio.run_coroutine_threadsafe(asyncio.start_server(api.handle, host, port), sched.loop).result()
+    api.warmer.touch()
+    print(f"{APP_NAME} API on http://{host}:{port}  (models {', '.join(ROUTE_MODELS)}, {sched.limit} concurrent)")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        sched.loop.call_soon_threadsafe(server.close)
+
+def _batch_one(rec: dict) -> dict:
+    opts  = gen_options(rec["mode"])
+    msgs  = build_msgs([], rec["prompt"], rec["mode"], prompt_budget(opts["num_predict"]))
+    stats, parts, t0, ttft = {"route": router().pick(rec["mode"], rec["prompt"])}, [], time.perf_counter(), None
+    try:
+        for tok in stream_response(msgs, stats, "batch", options=opts, model=ROUTES[stats["route"]]):
+            if ttft is None:
+                ttft = round(time.perf_counter() - t0, 3)
+            parts.append(tok)
+        reply_budget().observe(rec["mode"], stats)
+    except Exception as exc:
+        stats["error"] = str(exc)
+    return {**rec, "answer": ''.join(parts), "elapsed": round(time.perf_counter() - t0, 3), "ttft": ttft,
+            "ctx_tokens": msgs_tokens(msgs), **{k: v for k, v in stats.items() if v is not None}}
+
+def run_batch(src: str, out: str, parallel: int, mode: str = "Normal"):
+    # JSONL in ({"prompt", "mode"?, "id"?} per line), JSONL out in completion
+    # order. Records already answered in `out` are skipped, so a crashed run
+    # resumes where it stopped; failed ones are retried.
+    todo, done = [], set()
+    if os.path.exists(out):
+        with open(out, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    r = json.loads(line)
+                except ValueError:
+                    continue                    # torn last line from a crash
+                if "error" not in r:
+                    done.add(r["id"])
+    with open(src, encoding="utf-8") as f:
+        for n, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            try:
+                rec = json.loads(line)
+            except json.JSONDecodeError as exc:
+                raise SystemExit(f"{src}:{n}: invalid JSON ({exc.msg})")
+            if not isinstance(rec, dict) or not isinstance(rec.get("prompt"), str):
+                raise SystemExit(f"{src}:{n}: expected an object with a string \"prompt\"")
+            rec.setdefault("mode", mode)
+            if not isinstance(rec["mode"], str) or rec["mode"] not in MODE_PROMPTS:
+                raise SystemExit(f"{src}:{n}: unknown mode {rec['mode']!r}")
+            rec["id"] = rec.get("id") or hashlib.sha256(f"{rec['mode']}\0{rec['prompt']}".encode()).hexdigest()[:16]
+            if rec["id"] not in done:
+                todo.append(rec)
+    print(f"{len(todo)} to run, {len(done)} already in {out}, {parallel} in parallel")
+    scheduler().limit = parallel
+    t0, toks, fails = time.perf_counter(), 0, 0
+    with open(out, "a", encoding="utf-8") as f, ThreadPoolExecutor(parallel) as pool:
+        for i, fut in enumerate(as_completed([pool.submit(_batch_one, r) for r in todo]), 1):
+            r = fut.result()
+            f.write(json.dumps(r, ensure_ascii=False) + "\n"); f.flush()
+            toks  += r.get("eval_count") or 0
+            fails += "error" in r
+            print(f"[{i}/{len(todo)}] {r['id']} {r['mode']:<12} {r['elapsed']:>7.2f}s"
+                  + (f"  ERROR {r['error']}" if "error" in r else f"  {r.get('eval_count')} tok"))
+    wall = time.perf_counter() - t0
+    if todo:
+        print(f"{len(todo) - fails} ok / {fails} failed in {wall:.1f}s  ·  "
+              f"{len(todo) / wall:.2f} req/s  ·  {toks / wall:.1f} tok/s")
+
+def cli():
+    import argparse
+    ap = argparse.ArgumentParser(description=f"{APP_NAME} — run `streamlit run cyberbot.py` for the UI")
+    ap.add_argument("--serve", action="store_true", help="start the headless HTTP/SSE API")
+    ap.add_argument("--host", default=os.environ.get("CYBERBOT_API_HOST", "127.0.0.1"))
+    ap.add_argument("--port", type=int, default=int(os.environ.get("CYBERBOT_API_PORT", 8765)))
+    ap.add_argument("--batch", metavar="IN.jsonl", help="answer every {prompt, mode} record in a JSONL file")
+    ap.add_argument("--out", metavar="OUT.jsonl", help="batch results, appended as they complete (default: IN.out.jsonl)")
+    ap.add_argument("--parallel", type=int, default=MAX_CONCURRENT, help="concurrent batch requests")
+    ap.add_argument("--mode", default="Normal", choices=list(MODE_PROMPTS), help="batch mode for records without one")
+    args = ap.parse_args()
+    if args.batch:
+        run_batch(args.batch, args.out or os.path.splitext(args.batch)[0] + ".out.jsonl", max(1, args.parallel), args.mode)
+    elif args.serve:
+        serve(args.host, args.port)
+    else:
+        ap.print_help()
+
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    if st.runtime.exists():
+        main()
+    else:
+        cli()
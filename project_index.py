@@ -0,0 +1,260 @@
+"""
+Project index for CyberBot: source files chunked by function/class, a BM25
+inverted index in SQLite, incremental re-indexing by mtime/size/hash.
+
+Kept apart from cyberbot.py (and free of Streamlit) so ProcessPool workers
+can import it by name.
+"""
+
+import ast, hashlib, heapq, math, multiprocessing, os, re, sqlite3, threading, time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+
+# ═══════════════════════════════════════════════════════════════════════
+#  CONFIG
+# ═══════════════════════════════════════════════════════════════════════
+CHUNK_LINES = 120             # longer functions/classes are split into windows of this many lines
+MAX_FILE    = 1_000_000       # bytes; larger files are skipped (generated / vendored)
+QUERY_TERMS = 256             # distinct query terms scored, most specific first
+POOL_MIN    = 16              # changed files needed before indexing fans out to processes
+K1, B       = 1.2, 0.75       # BM25
+EXTS = {
+    ".py", ".pyi", ".js", ".jsx", ".mjs", ".ts", ".tsx", ".java", ".kt", ".scala", ".go", ".rs",
+    ".c", ".h", ".cc", ".cpp", ".hpp", ".cs", ".rb", ".php", ".swift", ".m", ".lua", ".sh",
+    ".sql", ".r", ".jl", ".dart", ".vue", ".svelte", ".toml", ".yaml", ".yml", ".md", ".rst",
+}
+SKIP_DIRS = {".git", ".hg", ".svn", "node_modules", "__pycache__", ".venv", "venv", "env",
+             ".tox", ".mypy_cache", ".pytest_cache", "build", "dist", "target", ".idea", ".vscode"}
+STOP = {"self", "return", "the", "if", "else", "elif", "for", "in", "def", "import", "from", "and",
+        "or", "not", "is", "none", "null", "true", "false", "to", "of", "a", "an", "this", "var",
+        "let", "const", "new", "int", "str", "with", "as", "be", "it", "on", "at", "by"}
+
+# ═══════════════════════════════════════════════════════════════════════
+#  TOKENS AND CHUNKS
+# ═══════════════════════════════════════════════════════════════════════
+WORD_RE = re.compile(r'[A-Za-z_][A-Za-z0-9_]+')
+SUB_RE  = re.compile(r'[A-Z]+(?=[A-Z][a-z])|[A-Z]?[a-z]+|[A-Z]+|[0-9]+')
+DEF_RE  = re.compile(r'^[ \t]{0,4}(?:(?:export|public|private|protected|static|async|pub|abstract|final)\s+)*'
+                     r'(?:def|class|function|func|fn|interface|struct|enum|impl|trait|module|type)\s+([A-Za-z_$][\w$]*)')
+
+def terms(text: str) -> list:
+    # Identifiers as written plus their snake/camelCase parts, so
+    # `parseConfig` matches "parse config" and `parse_config`.
+    out = []
+    for w in WORD_RE.findall(text):
+        lw = w.lower()
+        if lw not in STOP:
+            out.append(lw)
+        parts = SUB_RE.findall(w)
+        if len(parts) > 1:
+            out.extend(p for p in (p.lower() for p in parts) if len(p) > 1 and p not in STOP)
+    return out
+
+def _py_spans(text: str) -> list:
+    spans = []
+    for node in ast.parse(text).body:
+        if not isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+            continue
+        start = min([node.lineno] + [d.lineno for d in node.decorator_list])
+        kind  = "class" if isinstance(node, ast.ClassDef) else "def"
+        if kind == "class" and node.end_lineno - start >= CHUNK_LINES:
+            # Big class: its header, then one chunk per method.
+            methods = [n for n in node.body if isinstance(n, (ast.FunctionDef, ast.AsyncFunctionDef))]
+            head    = min([n.lineno for n in methods] + [node.end_lineno + 1]) - 1
+            spans.append((start, head, f"class {node.name}"))
+            for m in methods:
+                m_start = min([m.lineno] + [d.lineno for d in m.decorator_list])
+                spans.append((m_start, m.end_lineno, f"def {node.name}.{m.name}"))
+        else:
+            spans.append((start, node.end_lineno, f"{kind} {node.name}"))
+    return spans
+
+def _regex_spans(lines: list) -> list:
+    starts = [(i + 1, m.group(1)) for i, line in enumerate(lines) if (m := DEF_RE.match(line))]
+    return [(s, (starts[j + 1][0] - 1 if j + 1 < len(starts) else len(lines)), name)
+            for j, (s, name) in enumerate(starts)]
+
+def chunk_source(path: str, text: str) -> list:
+    # [(start, end, name, text)] with 1-based inclusive lines. Definitions
+    # come from the AST for Python and a definition-line regex otherwise;
+    # code between them becomes "module" chunks and anything longer than
+    # CHUNK_LINES is cut into windows.
+    lines = text.splitlines()
+    spans = []
+    if path.endswith((".py", ".pyi")):
+        try:
+            spans = _py_spans(text)
+        except (SyntaxError, ValueError):
+            spans = []
+    if not spans:
+        spans = _regex_spans(lines)
+    filled, pos = [], 1
+    for start, end, name in sorted(spans):
+        if start > pos:
+            filled.append((pos, start - 1, "module"))
+        if end >= max(start, pos):
+            filled.append((max(start, pos), end, name))
+        pos = max(pos, end + 1)
+    if pos <= len(lines):
+        filled.append((pos, len(lines), "module"))
+    out = []
+    for start, end, name in filled:
+        for s in range(start, end + 1, CHUNK_LINES):
+            e    = min(end, s + CHUNK_LINES - 1)
+            body = "\n".join(lines[s - 1:e])
+            if body.strip():
+                out.append((s, e, name if e - s + 1 == end - start + 1 else f"{name} (from line {s})", body))
+    return out
+
+def scan_file(job: tuple):
+    # Process-pool worker. `job` is (abs path, rel path, stored hash); the
+    # chunks are only rebuilt when the content hash changed.
+    path, rel, old_hash = job
+    try:
+        with open(path, "rb") as f:
+            raw = f.read(MAX_FILE + 1)
+        st = os.stat(path)
+    except OSError:
+        return rel, None, None, None, None
+    digest = hashlib.sha1(raw).hexdigest()
+    if len(raw) > MAX_FILE or b"\0" in raw[:8192]:
+        return rel, st.st_mtime, st.st_size, digest, []
+    if digest == old_hash:
+        return rel, st.st_mtime, st.st_size, digest, None
+    text   = raw.decode("utf-8", errors="replace")
+    chunks = []
+    for start, end, name, body in chunk_source(rel, text):
+        tf = Counter(terms(body) + terms(rel) + terms(name))
+        chunks.append((start, end, name, body, sum(tf.values()), tf))
+    return rel, st.st_mtime, st.st_size, digest, chunks
+
+def walk(root: str):
+    # (abs path, rel path, stat) of every indexable file under root.
+    stack = [root]
+    while stack:
+        try:
+            entries = list(os.scandir(stack.pop()))
+        except OSError:
+            continue
+        for e in entries:
+            if e.is_dir(follow_symlinks=False):
+                if e.name not in SKIP_DIRS and not e.name.startswith("."):
+                    stack.append(e.path)
+            elif e.is_file(follow_symlinks=False) and os.path.splitext(e.name)[1].lower() in EXTS:
+                st = e.stat()
+                if st.st_size <= MAX_FILE:
+                    yield e.path, os.path.relpath(e.path, root).replace(os.sep, "/"), st
+
+# ═══════════════════════════════════════════════════════════════════════
+#  INDEX
+# ═══════════════════════════════════════════════════════════════════════
+class ProjectIndex:
+    # One SQLite file per project root. `files` remembers mtime/size/hash so
+    # a rescan only re-reads files whose mtime or size moved and only
+    # re-chunks those whose content changed; `postings` is the inverted
+    # index. Chunk lengths and the corpus stats BM25 needs stay in memory.
+    def __init__(self, root: str, path: str):
+        self.root    = os.path.abspath(root)
+        self.scanned = 0.0
+        self._lock   = threading.Lock()
+        self._db     = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(
+            "CREATE TABLE IF NOT EXISTS files (path TEXT PRIMARY KEY, mtime REAL, size INTEGER, hash TEXT) WITHOUT ROWID;"
+            "CREATE TABLE IF NOT EXISTS chunks (id INTEGER PRIMARY KEY, path TEXT, start INTEGER, end INTEGER,"
+            " name TEXT, text TEXT, length INTEGER);"
+            "CREATE INDEX IF NOT EXISTS chunks_path ON chunks(path);"
+            "CREATE TABLE IF NOT EXISTS postings (term TEXT, chunk INTEGER, tf INTEGER,"
+            " PRIMARY KEY (term, chunk)) WITHOUT ROWID;"
+            "CREATE INDEX IF NOT EXISTS postings_chunk ON postings(chunk);")
+        self._load()
+
+    def _load(self):
+        rows         = self._db.execute("SELECT id, length FROM chunks").fetchall()
+        self._len    = dict(rows)
+        self.n       = len(rows)
+        self.avgdl   = (sum(self._len.values()) / self.n) if self.n else 1.0
+        self.files   = self._db.execute("SELECT COUNT(*) FROM files").fetchone()[0]
+        self.lines   = self._db.execute("SELECT COALESCE(SUM(end - start + 1), 0) FROM chunks").fetchone()[0]
+
+    def update(self, workers: int = None, progress=None) -> dict:
+        # Incremental (re)index of the whole root; returns what changed.
+        t0    = time.perf_counter()
+        known = {p: (m, s, h) for p, m, s, h in self._db.execute("SELECT path, mtime, size, hash FROM files")}
+        seen, jobs = set(), []
+        for path, rel, st in walk(self.root):
+            seen.add(rel)
+            old = known.get(rel)
+            if old is None or old[0] != st.st_mtime or old[1] != st.st_size:
+                jobs.append((path, rel, old[2] if old else None))
+        gone = [p for p in known if p not in seen]
+        if len(jobs) >= POOL_MIN and (workers or os.cpu_count() or 1) > 1:
+            # spawn, not fork: the host process is a threaded server (event
+            # loops, SQLite handles) that must not be copied mid-flight.
+            with ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+                results = self._collect(pool.map(scan_file, jobs, chunksize=8), len(jobs), progress)
+        else:
+            results = self._collect(map(scan_file, jobs), len(jobs), progress)
+        changed = 0
+        with self._lock:
+            self._db.execute("BEGIN")
+            for rel in gone:
+                self._drop(rel)
+                self._db.execute("DELETE FROM files WHERE path=?", (rel,))
+            for rel, mtime, size, digest, chunks in results:
+                if mtime is None:
+                    continue
+                if chunks is not None:
+                    changed += 1
+                    self._drop(rel)
+                    for start, end, name, body, length, tf in chunks:
+                        cid = self._db.execute("INSERT INTO chunks (path, start, end, name, text, length)"
+                                               " VALUES (?,?,?,?,?,?)", (rel, start, end, name, body, length)).lastrowid
+                        self._db.executemany("INSERT INTO postings VALUES (?,?,?)",
+                                             ((t, cid, n) for t, n in tf.items()))
+                self._db.execute("INSERT OR REPLACE INTO files VALUES (?,?,?,?)", (rel, mtime, size, digest))
+            self._db.execute("COMMIT")
+            self._load()
+        self.scanned = time.time()
+        return {"files": self.files, "scanned": len(jobs), "changed": changed, "removed": len(gone),
+                "chunks": self.n, "lines": self.lines, "seconds": round(time.perf_counter() - t0, 2)}
+
+    @staticmethod
+    def _collect(results, total: int, progress) -> list:
+        out = []
+        for i, r in enumerate(results, 1):
+            out.append(r)
+            if progress and (i == total or i % 50 == 0):
+                progress(i, total)
+        return out
+
+    def _drop(self, rel: str):
+        self._db.execute("DELETE FROM postings WHERE chunk IN (SELECT id FROM chunks WHERE path=?)", (rel,))
+        self._db.execute("DELETE FROM chunks WHERE path=?", (rel,))
+
+    def refresh(self, max_age: float) -> dict:
+        # Cheap enough to call before every query: a stat walk at most every max_age seconds.
+        return self.update() if time.time() - self.scanned > max_age else {}
+
+    def search(self, query: str, k: int) -> list:
+        # BM25 over chunks; [{path, start, end, name, text, score}] best first.
+        q = sorted(set(terms(query)), key=len, reverse=True)[:QUERY_TERMS]
+        if not q or not self.n:
+            return []
+        marks = ",".join("?" * len(q))
+        with self._lock:
+            rows = self._db.execute(f"SELECT term, chunk, tf FROM postings WHERE term IN ({marks})", q).fetchall()
+            df   = Counter(t for t, _, _ in rows)
+            idf  = {t: math.log(1 + (self.n - n + 0.5) / (n + 0.5)) for t, n in df.items()}
+            a, b  = K1 * (1 - B), K1 * B / self.avgdl
+            score = {}
+            for t, cid, tf in rows:
+                score[cid] = score.get(cid, 0.0) + idf[t] * tf * (K1 + 1) / (tf + a + b * self._len[cid])
+            best = heapq.nlargest(k, score.items(), key=lambda kv: kv[1])
+            hits = []
+            for cid, s in best:
+                path, start, end, name, text = self._db.execute(
+                    "SELECT path, start, end, name, text FROM chunks WHERE id=?", (cid,)).fetchone()
+                hits.append({"path": path, "start": start, "end": end, "name": name, "text": text, "score": round(s, 3)})
+        return hits